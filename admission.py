@@ -0,0 +1,209 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+ADMISSION_MAX_CONCURRENT = int(os.getenv("ADMISSION_MAX_CONCURRENT", 4))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", 30))
+ADMISSION_MAX_QUEUED_PER_USER = int(os.getenv("ADMISSION_MAX_QUEUED_PER_USER", 2))
+ADMISSION_MAX_WAIT = float(os.getenv("ADMISSION_MAX_WAIT", 60))
+ADMISSION_USER_BURST = float(os.getenv("ADMISSION_USER_BURST", 3))
+ADMISSION_USER_RATE = float(os.getenv("ADMISSION_USER_RATE", 3 / 60))
+ADMISSION_CHAT_BURST = float(os.getenv("ADMISSION_CHAT_BURST", 6))
+ADMISSION_CHAT_RATE = float(os.getenv("ADMISSION_CHAT_RATE", 6 / 60))
+ADMISSION_MAX_BUCKETS = int(os.getenv("ADMISSION_MAX_BUCKETS", 10000))
+# Pemilik antrean untuk scraping tanpa user (refresh cache basi); tidak kena token bucket, tetap kena batas global
+ADMISSION_BACKGROUND_USER = "background"
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason, retry_after=None):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+class TokenBucket:
+    def __init__(self, capacity, rate):
+        self.capacity = capacity
+        self.rate = rate
+        self.tokens = capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    def available(self):
+        self._refill()
+        return self.tokens >= 1
+
+    def retry_after(self):
+        self._refill()
+        return max(0.0, (1 - self.tokens) / self.rate)
+
+    def take(self):
+        self.tokens -= 1
+
+    def is_full(self):
+        self._refill()
+        return self.tokens >= self.capacity
+
+# Admission untuk scraping harga: token bucket per user dan per chat, batas scraping bersamaan global, dan antrean
+# adil yang melayani user secara round-robin sehingga satu user/grup yang ramai tidak memblokir yang lain.
+# Permintaan ditolak cepat (bukan ditumpuk) saat antrean penuh atau terlalu lama menunggu.
+# Token bucket dibebankan per permintaan (charge), slot konkurensi per scraping yang benar-benar dijalankan (slot).
+class AdmissionController:
+    def __init__(self, max_concurrent=ADMISSION_MAX_CONCURRENT, max_queue=ADMISSION_MAX_QUEUE):
+        self.max_concurrent = max_concurrent
+        self.max_queue = max_queue
+        self.active = 0
+        # user_id -> deque[(future, on_position)], urutan key = giliran round-robin berikutnya
+        self.waiting = OrderedDict()
+        self.user_buckets = {}
+        self.chat_buckets = {}
+        # Referensi task laporan posisi disimpan agar tidak dibuang garbage collector di tengah jalan
+        self.position_tasks = set()
+
+    def _bucket(self, buckets, key, capacity, rate):
+        bucket = buckets.get(key)
+        if bucket is None:
+            # Bucket yang sudah penuh kembali sama dengan bucket baru, jadi aman dibuang
+            if len(buckets) >= ADMISSION_MAX_BUCKETS:
+                for stale_key in [k for k, b in buckets.items() if b.is_full()]:
+                    del buckets[stale_key]
+            bucket = buckets[key] = TokenBucket(capacity, rate)
+        return bucket
+
+    def has_capacity(self):
+        return self.active < self.max_concurrent and not self.waiting
+
+    def queue_length(self):
+        return sum(len(waiters) for waiters in self.waiting.values())
+
+    # Urutan layanan: waiter pertama tiap user sesuai giliran, lalu waiter kedua tiap user, dan seterusnya
+    def _service_order(self):
+        queues = [list(waiters) for waiters in self.waiting.values()]
+        order = []
+        for depth in range(max((len(queue) for queue in queues), default=0)):
+            order.extend(queue[depth] for queue in queues if depth < len(queue))
+        return order
+
+    def _report_position(self, on_position, position):
+        task = asyncio.create_task(on_position(position))
+        self.position_tasks.add(task)
+        task.add_done_callback(self._position_reported)
+
+    def _position_reported(self, task):
+        self.position_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"⚠️ Gagal melaporkan posisi antrean: {task.exception()}")
+
+    def _notify_positions(self):
+        for position, (_, on_position) in enumerate(self._service_order(), start=1):
+            if on_position:
+                self._report_position(on_position, position)
+
+    def _dispatch(self):
+        dispatched = False
+        while self.active < self.max_concurrent and self.waiting:
+            user_id, waiters = self.waiting.popitem(last=False)
+            future, on_position = waiters.popleft()
+            if waiters:
+                self.waiting[user_id] = waiters
+            if future.done():
+                continue
+            future.set_result(None)
+            self.active += 1
+            # Posisi 0 berarti giliran sudah tiba dan scraping dimulai
+            if on_position:
+                self._report_position(on_position, 0)
+            dispatched = True
+        if dispatched:
+            self._notify_positions()
+
+    def _remove_waiter(self, user_id, entry):
+        waiters = self.waiting.get(user_id)
+        if waiters and entry in waiters:
+            waiters.remove(entry)
+            if not waiters:
+                del self.waiting[user_id]
+            self._notify_positions()
+
+    def charge(self, user_id, chat_id):
+        user_bucket = self._bucket(self.user_buckets, user_id, ADMISSION_USER_BURST, ADMISSION_USER_RATE)
+        chat_bucket = self._bucket(self.chat_buckets, chat_id, ADMISSION_CHAT_BURST, ADMISSION_CHAT_RATE)
+        if not user_bucket.available() or not chat_bucket.available():
+            raise AdmissionRejected("rate_limited", max(user_bucket.retry_after(), chat_bucket.retry_after()))
+        user_bucket.take()
+        chat_bucket.take()
+
+    async def acquire(self, user_id, on_position=None):
+        if self.has_capacity():
+            self.active += 1
+            return
+        if self.queue_length() >= self.max_queue or len(self.waiting.get(user_id, ())) >= ADMISSION_MAX_QUEUED_PER_USER:
+            logger.warning(f"🚦 Antrean scraping penuh ({self.queue_length()} menunggu), permintaan user {user_id} ditolak")
+            raise AdmissionRejected("overloaded")
+
+        entry = (asyncio.get_running_loop().create_future(), on_position)
+        self.waiting.setdefault(user_id, deque()).append(entry)
+        self._notify_positions()
+        try:
+            await asyncio.wait_for(asyncio.shield(entry[0]), timeout=ADMISSION_MAX_WAIT)
+        except asyncio.TimeoutError:
+            # Slot bisa saja sudah diberikan _dispatch tepat saat batas waktu habis; slot itu dipakai, bukan dibuang
+            if entry[0].done() and not entry[0].cancelled():
+                return
+            entry[0].cancel()
+            self._remove_waiter(user_id, entry)
+            logger.warning(f"🚦 User {user_id} menunggu lebih dari {ADMISSION_MAX_WAIT:.0f} detik, permintaan dilepas")
+            raise AdmissionRejected("timeout")
+        except asyncio.CancelledError:
+            if entry[0].done() and not entry[0].cancelled():
+                self.release()
+            else:
+                entry[0].cancel()
+                self._remove_waiter(user_id, entry)
+            raise
+
+    def release(self):
+        self.active -= 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, user_id, on_position=None):
+        await self.acquire(user_id, on_position)
+        try:
+            yield
+        finally:
+            self.release()
+
+    def background_slot(self):
+        return self.slot(ADMISSION_BACKGROUND_USER)
+
+    def ticket(self, user_id, chat_id, on_position=None):
+        return AdmissionTicket(self, user_id, chat_id, on_position)
+
+    def snapshot(self):
+        return {"active": self.active, "queued": self.queue_length(), "users_waiting": len(self.waiting)}
+
+# Satu permintaan harga dari user di sebuah chat, diteruskan ke scrape_price
+class AdmissionTicket:
+    def __init__(self, controller, user_id, chat_id, on_position=None):
+        self.controller = controller
+        self.user_id = user_id
+        self.chat_id = chat_id
+        self.on_position = on_position
+
+    def charge(self):
+        self.controller.charge(self.user_id, self.chat_id)
+
+    def slot(self):
+        return self.controller.slot(self.user_id, self.on_position)
+
+admission = AdmissionController()
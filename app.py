@@ -1,226 +1,281 @@
 import asyncio
+import hmac
+import json
 import os
 import logging
 import signal
 import time
 import redis
-import subprocess
-from flask import Flask, render_template, jsonify, request
-from logging.handlers import QueueHandler
-from queue import Queue
+from aiohttp import web
 from proxy_scraper import scrape_and_store_proxies
-from chat_handler import run_telegram_bot, shutdown_telegram
-from utils import logger
-
-# Konfigurasi Redis
-REDIS_HOST = os.getenv("REDIS_HOST", "redis.railway.internal")
-REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
-REDIS_PASSWORD = os.getenv("REDIS_PASSWORD")
-redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, password=REDIS_PASSWORD, db=0, decode_responses=True)
+from chat_handler import (
+    run_telegram_bot, shutdown_telegram, webhook_path, feed_webhook_update, TELEGRAM_WEBHOOK_SECRET,
+)
+from utils import (
+    logger, load_price_history, save_price_history, remove_price_history, migrate_price_history_index,
+    load_chat_history, save_chat_history, remove_chat_history, migrate_chat_history,
+)
+from price_record import PriceRecord
+from proxy_pool import add_proxies, remove_proxy, list_proxies, migrate_proxy_list
+from redis_store import redis_client
+from log_store import install_log_handler, run_log_shipper, flush_logs, read_logs, clear_logs as clear_log_store, parse_log_level
+from dashboard_hub import dashboard_hub, collect_counters, build_snapshot, price_history_display
 
 TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+PORT = int(os.getenv("PORT", 8080))
+PROXY_SCHEDULER_TICK = float(os.getenv("PROXY_SCHEDULER_TICK", 60))
+SSE_HEARTBEAT_INTERVAL = float(os.getenv("SSE_HEARTBEAT_INTERVAL", 15))
+TEMPLATE_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "templates")
 
-# Setup logging dengan queue untuk frontend
-log_queue = Queue()
-log_handler = QueueHandler(log_queue)
 logging.basicConfig(level=logging.WARNING, format="%(asctime)s - %(levelname)s - %(message)s")
 logging.getLogger("httpx").setLevel(logging.WARNING)
 logging.getLogger("telegram").setLevel(logging.WARNING)
 logger = logging.getLogger(__name__)
 logger.setLevel(logging.INFO)
-logger.addHandler(log_handler)
-
-# Buffer untuk menyimpan log terbaru
-log_buffer = []
 
-# Inisialisasi Flask
-app = Flask(__name__)
+# Diisi setelah bot siap; sebelum itu webhook dibalas 503
+telegram_app = None
 
-# Fungsi untuk memproses log ke buffer
-def process_logs():
-    while not log_queue.empty():
-        log_record = log_queue.get()
-        log_time = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(log_record.created))
-        log_entry = f"{log_time} - {log_record.levelname} - {log_record.message}"
-        log_buffer.append(log_entry)
+# Dashboard, API, dan webhook Telegram dilayani satu server aiohttp di event loop yang sama dengan bot
+routes = web.RouteTableDef()
 
-# Endpoint Flask untuk dashboard
-@app.route('/')
-def dashboard():
+# Endpoint untuk dashboard
+@routes.get('/')
+async def dashboard(request):
     logger.info("ℹ️ Mengakses endpoint dashboard")
-    return render_template('dashboard.html')
-
-# API untuk data monitoring
-@app.route('/api/monitoring', methods=['GET'])
-def monitoring_data():
-    process_logs()
-    redis_status = "Connected" if check_redis_connection() else "Disconnected"
-    proxy_count = redis_client.llen("proxy_list") or 0
-    chat_history_count = redis_client.llen("chat_history") or 0
-    price_history_count = redis_client.hlen("price_history") or 0
-    
-    return jsonify({
-        "logs": log_buffer,
-        "redis_status": redis_status,
-        "proxy_count": proxy_count,
-        "chat_history_count": chat_history_count,
-        "price_history_count": price_history_count
+    return web.FileResponse(os.path.join(TEMPLATE_DIR, 'dashboard.html'))
+
+# API untuk data monitoring. Log diambil bertahap: klien mengirim log_cursor dari respons sebelumnya
+# sehingga hanya menerima entri baru, dan bisa menyaring level minimum lewat parameter level
+@routes.get('/api/monitoring')
+async def monitoring_data(request):
+    min_level = parse_log_level(request.query.get("level"))
+    if min_level is None:
+        return web.json_response({"status": "error", "message": "Unknown log level"}, status=400)
+    logs, log_cursor = await read_logs(request.query.get("cursor"), min_level)
+    return web.json_response({"logs": logs, "log_cursor": log_cursor, **await collect_counters()})
+
+def format_sse(event, data):
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n".encode()
+
+# Stream SSE untuk dashboard: satu snapshot lengkap saat tersambung, lalu hanya delta (log baru, counter yang
+# berubah, dan entri proxy/history yang ditambah atau dihapus). Klien didaftarkan ke hub sebelum snapshot dibaca
+# agar tidak ada perubahan yang terlewat di antaranya; delta yang tumpang tindih dengan snapshot aman diterapkan ulang
+@routes.get('/api/events')
+async def dashboard_events_stream(request):
+    min_level = parse_log_level(request.query.get("level"))
+    if min_level is None:
+        return web.json_response({"status": "error", "message": "Unknown log level"}, status=400)
+    response = web.StreamResponse(headers={
+        "Content-Type": "text/event-stream",
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",
     })
+    await response.prepare(request)
+    client = dashboard_hub.subscribe(min_level)
+    try:
+        await response.write(b"retry: 5000\n\n" + format_sse("snapshot", await build_snapshot(min_level)))
+        while True:
+            try:
+                event = await asyncio.wait_for(client.queue.get(), timeout=SSE_HEARTBEAT_INTERVAL)
+            except asyncio.TimeoutError:
+                await response.write(b": ping\n\n")
+                continue
+            if event is None:
+                break
+            await response.write(format_sse(*event))
+    except (ConnectionResetError, redis.RedisError) as e:
+        logger.debug(f"ℹ️ Stream dashboard ditutup: {e}")
+    finally:
+        dashboard_hub.unsubscribe(client)
+    return response
 
 # API untuk membersihkan log
-@app.route('/api/clear_logs', methods=['POST'])
-def clear_logs():
-    global log_buffer
-    log_buffer = []
+@routes.post('/api/clear_logs')
+async def clear_logs(request):
+    await clear_log_store()
     logger.info("ℹ️ Log telah dibersihkan")
-    return jsonify({"status": "success", "message": "Logs cleared"})
+    return web.json_response({"status": "success", "message": "Logs cleared"})
 
 # CRUD untuk Proxy
-@app.route('/api/proxies', methods=['GET'])
-def get_proxies():
-    proxies = redis_client.lrange("proxy_list", 0, -1)
-    return jsonify({"proxies": proxies})
-
-@app.route('/api/proxies', methods=['POST'])
-def add_proxy():
-    proxy = request.json.get('proxy')
+@routes.get('/api/proxies')
+async def get_proxies(request):
+    proxies = await list_proxies()
+    return web.json_response({"proxies": proxies})
+
+@routes.post('/api/proxies')
+async def add_proxy(request):
+    proxy = (await request.json()).get('proxy')
     if proxy:
-        redis_client.lpush("proxy_list", proxy)
+        await add_proxies([proxy])
         logger.info(f"ℹ️ Proxy {proxy} ditambahkan")
-        return jsonify({"status": "success", "message": f"Proxy {proxy} added"})
-    return jsonify({"status": "error", "message": "Proxy is required"}), 400
-
-@app.route('/api/proxies', methods=['PUT'])
-def update_proxy():
-    old_proxy = request.json.get('old_proxy')
-    new_proxy = request.json.get('new_proxy')
-    if old_proxy and new_proxy and redis_client.lrem("proxy_list", 0, old_proxy) > 0:
-        redis_client.lpush("proxy_list", new_proxy)
+        return web.json_response({"status": "success", "message": f"Proxy {proxy} added"})
+    return web.json_response({"status": "error", "message": "Proxy is required"}, status=400)
+
+@routes.put('/api/proxies')
+async def update_proxy(request):
+    data = await request.json()
+    old_proxy = data.get('old_proxy')
+    new_proxy = data.get('new_proxy')
+    if old_proxy and new_proxy and await remove_proxy(old_proxy) > 0:
+        await add_proxies([new_proxy])
         logger.info(f"ℹ️ Proxy {old_proxy} diperbarui menjadi {new_proxy}")
-        return jsonify({"status": "success", "message": f"Proxy updated to {new_proxy}"})
-    return jsonify({"status": "error", "message": "Proxy not found or invalid data"}), 404
+        return web.json_response({"status": "success", "message": f"Proxy updated to {new_proxy}"})
+    return web.json_response({"status": "error", "message": "Proxy not found or invalid data"}, status=404)
 
-@app.route('/api/proxies', methods=['DELETE'])
-def delete_proxy():
-    proxy = request.json.get('proxy')
-    if proxy and redis_client.lrem("proxy_list", 0, proxy) > 0:
+@routes.delete('/api/proxies')
+async def delete_proxy(request):
+    proxy = (await request.json()).get('proxy')
+    if proxy and await remove_proxy(proxy) > 0:
         logger.info(f"ℹ️ Proxy {proxy} dihapus")
-        return jsonify({"status": "success", "message": f"Proxy {proxy} deleted"})
-    return jsonify({"status": "error", "message": "Proxy not found"}), 404
+        return web.json_response({"status": "success", "message": f"Proxy {proxy} deleted"})
+    return web.json_response({"status": "error", "message": "Proxy not found"}, status=404)
 
 # CRUD untuk Chat History
-@app.route('/api/chat_history', methods=['GET'])
-def get_chat_history():
-    chat_history = redis_client.lrange("chat_history", 0, -1)
-    return jsonify({"chat_history": chat_history})
-
-@app.route('/api/chat_history', methods=['POST'])
-def add_chat_history():
-    entry = request.json.get('entry')
+@routes.get('/api/chat_history')
+async def get_chat_history(request):
+    chat_history = await load_chat_history()
+    return web.json_response({"chat_history": chat_history})
+
+@routes.post('/api/chat_history')
+async def add_chat_history(request):
+    entry = (await request.json()).get('entry')
     if entry:
-        redis_client.lpush("chat_history", entry)
+        await save_chat_history(entry)
         logger.info(f"ℹ️ Chat history {entry} ditambahkan")
-        return jsonify({"status": "success", "message": f"Chat history {entry} added"})
-    return jsonify({"status": "error", "message": "Entry is required"}), 400
-
-@app.route('/api/chat_history', methods=['PUT'])
-def update_chat_history():
-    old_entry = request.json.get('old_entry')
-    new_entry = request.json.get('new_entry')
-    if old_entry and new_entry and redis_client.lrem("chat_history", 0, old_entry) > 0:
-        redis_client.lpush("chat_history", new_entry)
+        return web.json_response({"status": "success", "message": f"Chat history {entry} added"})
+    return web.json_response({"status": "error", "message": "Entry is required"}, status=400)
+
+@routes.put('/api/chat_history')
+async def update_chat_history(request):
+    data = await request.json()
+    old_entry = data.get('old_entry')
+    new_entry = data.get('new_entry')
+    if old_entry and new_entry and await remove_chat_history(old_entry) > 0:
+        await save_chat_history(new_entry)
         logger.info(f"ℹ️ Chat history {old_entry} diperbarui menjadi {new_entry}")
-        return jsonify({"status": "success", "message": f"Chat history updated to {new_entry}"})
-    return jsonify({"status": "error", "message": "Entry not found or invalid data"}), 404
+        return web.json_response({"status": "success", "message": f"Chat history updated to {new_entry}"})
+    return web.json_response({"status": "error", "message": "Entry not found or invalid data"}, status=404)
 
-@app.route('/api/chat_history', methods=['DELETE'])
-def delete_chat_history():
-    entry = request.json.get('entry')
-    if entry and redis_client.lrem("chat_history", 0, entry) > 0:
+@routes.delete('/api/chat_history')
+async def delete_chat_history(request):
+    entry = (await request.json()).get('entry')
+    if entry and await remove_chat_history(entry) > 0:
         logger.info(f"ℹ️ Chat history {entry} dihapus")
-        return jsonify({"status": "success", "message": f"Chat history {entry} deleted"})
-    return jsonify({"status": "error", "message": "Entry not found"}), 404
+        return web.json_response({"status": "success", "message": f"Chat history {entry} deleted"})
+    return web.json_response({"status": "error", "message": "Entry not found"}, status=404)
 
 # CRUD untuk Price History
-@app.route('/api/price_history', methods=['GET'])
-def get_price_history():
-    price_history = redis_client.hgetall("price_history")
-    return jsonify({"price_history": price_history})
-
-@app.route('/api/price_history', methods=['POST'])
-def add_price_history():
-    key = request.json.get('key')
-    value = request.json.get('value')
-    if key and value:
-        redis_client.hset("price_history", key, json.dumps(value))
+def parse_dashboard_price(value):
+    record = PriceRecord.from_display(value) if value else None
+    if record:
+        record.ts = time.time()
+    return record
+
+@routes.get('/api/price_history')
+async def get_price_history(request):
+    price_history = price_history_display(await load_price_history())
+    return web.json_response({"price_history": price_history})
+
+@routes.post('/api/price_history')
+async def add_price_history(request):
+    data = await request.json()
+    key = data.get('key')
+    record = parse_dashboard_price(data.get('value'))
+    if key and record:
+        await save_price_history(key, record)
         logger.info(f"ℹ️ Price history {key} ditambahkan")
-        return jsonify({"status": "success", "message": f"Price history {key} added"})
-    return jsonify({"status": "error", "message": "Key and value are required"}), 400
-
-@app.route('/api/price_history', methods=['PUT'])
-def update_price_history():
-    key = request.json.get('key')
-    value = request.json.get('value')
-    if key and value and redis_client.hexists("price_history", key):
-        redis_client.hset("price_history", key, json.dumps(value))
+        return web.json_response({"status": "success", "message": f"Price history {key} added"})
+    return web.json_response({"status": "error", "message": "Key and value are required"}, status=400)
+
+@routes.put('/api/price_history')
+async def update_price_history(request):
+    data = await request.json()
+    key = data.get('key')
+    record = parse_dashboard_price(data.get('value'))
+    if key and record and await redis_client.hexists("price_history", key):
+        await save_price_history(key, record)
         logger.info(f"ℹ️ Price history {key} diperbarui")
-        return jsonify({"status": "success", "message": f"Price history {key} updated"})
-    return jsonify({"status": "error", "message": "Key not found or invalid data"}), 404
+        return web.json_response({"status": "success", "message": f"Price history {key} updated"})
+    return web.json_response({"status": "error", "message": "Key not found or invalid data"}, status=404)
 
-@app.route('/api/price_history', methods=['DELETE'])
-def delete_price_history():
-    key = request.json.get('key')
-    if key and redis_client.hdel("price_history", key) > 0:
+@routes.delete('/api/price_history')
+async def delete_price_history(request):
+    key = (await request.json()).get('key')
+    if key and await remove_price_history(key) > 0:
         logger.info(f"ℹ️ Price history {key} dihapus")
-        return jsonify({"status": "success", "message": f"Price history {key} deleted"})
-    return jsonify({"status": "error", "message": "Key not found"}), 404
+        return web.json_response({"status": "success", "message": f"Price history {key} deleted"})
+    return web.json_response({"status": "error", "message": "Key not found"}, status=404)
 
-def check_redis_connection():
+# Webhook Telegram: update langsung masuk antrean worker bot. Selama bot belum siap atau antrean penuh,
+# balasan 503 membuat Telegram mencoba lagi nanti
+async def telegram_webhook(request):
+    if not TELEGRAM_WEBHOOK_SECRET or not hmac.compare_digest(
+        request.headers.get("X-Telegram-Bot-Api-Secret-Token", ""), TELEGRAM_WEBHOOK_SECRET
+    ):
+        return web.Response(status=403)
+    if telegram_app is None:
+        return web.Response(status=503)
     try:
-        redis_client.ping()
-        return True
-    except redis.RedisError:
-        return False
+        payload = await request.json()
+    except ValueError:
+        return web.Response(status=400)
+    if not feed_webhook_update(telegram_app, payload):
+        return web.Response(status=503)
+    return web.Response()
 
+# Tick pendek: tiap iterasi hanya mengerjakan sumber dan revalidasi proxy yang sudah jatuh tempo
 async def run_proxy_scraper_periodically():
     while True:
         try:
-            logger.info("🚀 Memulai scraping proxy...")
             await scrape_and_store_proxies()
-            logger.info("✅ Proxy scraping selesai untuk iterasi ini")
         except Exception as e:
             logger.error(f"❌ Gagal menjalankan proxy scraper: {e}")
-        await asyncio.sleep(5 * 60)
-
-async def run_flask():
-    port = int(os.getenv("PORT", 8080))
-    logger.info(f"🚀 Menjalankan Flask server dengan Gunicorn pada port {port}...")
-    gunicorn_process = subprocess.Popen([
-        "gunicorn",
-        "--bind", f"0.0.0.0:{port}",
-        "--workers", "2",
-        "app:app"
-    ])
-    await asyncio.sleep(1)
-    if gunicorn_process.poll() is not None:
-        logger.error("❌ Gunicorn gagal dimulai")
-    else:
-        logger.info("✅ Gunicorn berjalan")
+        await asyncio.sleep(PROXY_SCHEDULER_TICK)
+
+def create_web_app():
+    web_app = web.Application()
+    web_app.add_routes(routes)
+    web_app.on_shutdown.append(lambda _: dashboard_hub.close())
+    if webhook_path():
+        web_app.router.add_post(webhook_path(), telegram_webhook)
+    return web_app
+
+async def run_web_server(web_app):
+    runner = web.AppRunner(web_app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, "0.0.0.0", PORT).start()
+    logger.info(f"🚀 Server HTTP berjalan pada port {PORT}")
+    return runner
 
 async def main():
+    global telegram_app
+    install_log_handler()
+    log_task = asyncio.create_task(run_log_shipper())
+    try:
+        await migrate_price_history_index()
+        await migrate_proxy_list()
+        await migrate_chat_history()
+    except redis.RedisError as e:
+        logger.error(f"❌ Gagal migrasi data Redis: {e}")
+
+    # Server sudah menerima koneksi sebelum webhook didaftarkan ke Telegram
+    runner = await run_web_server(create_web_app())
     telegram_app = await run_telegram_bot(TOKEN)
-    
-    tasks = [
-        run_flask(),
-        run_proxy_scraper_periodically(),
-    ]
+    proxy_task = asyncio.create_task(run_proxy_scraper_periodically())
 
+    stop_event = asyncio.Event()
     loop = asyncio.get_running_loop()
     for sig in (signal.SIGINT, signal.SIGTERM):
-        loop.add_signal_handler(sig, lambda: asyncio.create_task(shutdown_telegram(telegram_app)))
+        loop.add_signal_handler(sig, stop_event.set)
 
     logger.info("🚀 Aplikasi utama sedang berjalan...")
-    await asyncio.gather(*tasks)
+    await stop_event.wait()
+    proxy_task.cancel()
+    await runner.cleanup()
+    log_task.cancel()
+    await flush_logs()
+    await shutdown_telegram(telegram_app)
 
 if __name__ == "__main__":
-    asyncio.run(main())
\ No newline at end of file
+    asyncio.run(main())
@@ -1,13 +1,51 @@
 import asyncio
+import hashlib
+import os
 import uuid
 import json
 import random
+from urllib.parse import urlparse
 import aiohttp
+import redis
 from telegram import Update, InlineQueryResultArticle, InputTextMessageContent
 from telegram.ext import Application, CommandHandler, MessageHandler, InlineQueryHandler, filters, CallbackContext
-from telegram.error import BadRequest
+from telegram.error import TelegramError
 from price_scraper import scrape_price
-from utils import load_chat_history, save_chat_history, normalize_price_query, logger
+from admission import admission, AdmissionRejected
+from outbound import outbound
+from price_record import format_rupiah
+from http_client import get_session, init_http_sessions, close_http_sessions
+from parse_pool import get_parse_pool, shutdown_parse_pool
+from suggestion_cache import get_cached_suggestions, cache_suggestions
+from ngram_model import get_ngram_model, load_ngram_model, save_ngram_model, train_ngram_model
+from redis_store import close_redis
+from utils import search_chat_history, save_chat_history, normalize_price_query, logger
+
+SUGGESTION_DEADLINE = float(os.getenv("SUGGESTION_DEADLINE", 1.5))
+SUGGESTION_LIMIT = 6
+INLINE_DEBOUNCE = float(os.getenv("INLINE_DEBOUNCE", 0.3))
+INLINE_SETTLE_DELAY = float(os.getenv("INLINE_SETTLE_DELAY", 3))
+# URL publik webhook (mis. https://bot.example.com/telegram). Jika kosong atau gagal dipasang, bot memakai polling.
+# URL tanpa path diberi path /telegram, dan URL itulah yang didaftarkan ke Telegram maupun dipakai sebagai route
+TELEGRAM_WEBHOOK_URL = os.getenv("TELEGRAM_WEBHOOK_URL")
+if TELEGRAM_WEBHOOK_URL and urlparse(TELEGRAM_WEBHOOK_URL).path in ("", "/"):
+    TELEGRAM_WEBHOOK_URL = TELEGRAM_WEBHOOK_URL.rstrip("/") + "/telegram"
+# Webhook selalu memakai secret. Jika tidak diatur, secret diturunkan dari token bot agar sama di semua replika
+TELEGRAM_WEBHOOK_SECRET = os.getenv("TELEGRAM_WEBHOOK_SECRET") or (
+    hashlib.sha256(f"webhook:{os.getenv('TELEGRAM_BOT_TOKEN')}".encode()).hexdigest() if os.getenv("TELEGRAM_BOT_TOKEN") else None
+)
+TELEGRAM_WEBHOOK_MAX_CONNECTIONS = int(os.getenv("TELEGRAM_WEBHOOK_MAX_CONNECTIONS", 40))
+TELEGRAM_UPDATE_WORKERS = int(os.getenv("TELEGRAM_UPDATE_WORKERS", 16))
+TELEGRAM_MAX_PENDING_UPDATES = int(os.getenv("TELEGRAM_MAX_PENDING_UPDATES", 200))
+TELEGRAM_DRAIN_TIMEOUT = float(os.getenv("TELEGRAM_DRAIN_TIMEOUT", 10))
+
+# user_id -> task yang sedang menjawab query inline terakhir user tersebut
+_inline_tasks = {}
+
+# Update dari webhook menunggu di antrean terbatas dan diproses oleh TELEGRAM_UPDATE_WORKERS worker
+_webhook_queue = None
+_webhook_workers = []
+_ngram_load_task = None
 
 # User agents dan headers
 USER_AGENTS = [
@@ -35,162 +73,337 @@ def get_headers(site):
         "Connection": "keep-alive",
     }
 
+# Fetcher mengembalikan (saran, complete) atau None jika gagal. complete berarti provider memberi lebih sedikit
+# dari SUGGESTION_LIMIT saran, sehingga daftar itu lengkap untuk prefix tersebut
 async def fetch_google_suggestions(query):
     url = f"https://suggestqueries.google.com/complete/search?client=firefox&q={query}&hl=id"
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.get(url, headers=get_headers("google"), timeout=aiohttp.ClientTimeout(total=5)) as response:
-                text = await response.text()
-                data = json.loads(text)
-                suggestions = data[1][:6] if len(data) > 1 else []
-                logger.info(f"ℹ️ Saran dari Google: {suggestions}")
-                return suggestions
-        except Exception as e:
-            logger.error(f"❌ Gagal mengambil saran dari Google: {e}")
-            return []
+    session = get_session()
+    try:
+        async with session.get(url, headers=get_headers("google"), timeout=aiohttp.ClientTimeout(total=5)) as response:
+            text = await response.text()
+            data = json.loads(text)
+            suggestions = data[1] if len(data) > 1 else []
+            logger.info(f"ℹ️ Saran dari Google: {suggestions[:SUGGESTION_LIMIT]}")
+            return suggestions[:SUGGESTION_LIMIT], len(suggestions) < SUGGESTION_LIMIT
+    except Exception as e:
+        logger.error(f"❌ Gagal mengambil saran dari Google: {e}")
+        return None
 
 async def fetch_bing_suggestions(query):
     url = f"https://api.bing.com/qsonhs.aspx?type=cb&q={query}"
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.get(url, headers=get_headers("bing"), timeout=aiohttp.ClientTimeout(total=5)) as response:
-                text = await response.text()
-                data = json.loads(text)
-                suggestions = [item["q"] for item in data["AS"]["Results"][0]["Suggests"]][:6] if "AS" in data else []
-                logger.info(f"ℹ️ Saran dari Bing: {suggestions}")
-                return suggestions
-        except Exception as e:
-            logger.error(f"❌ Gagal mengambil saran dari Bing: {e}")
-            return []
+    session = get_session()
+    try:
+        async with session.get(url, headers=get_headers("bing"), timeout=aiohttp.ClientTimeout(total=5)) as response:
+            text = await response.text()
+            data = json.loads(text)
+            suggestions = [item["q"] for item in data["AS"]["Results"][0]["Suggests"]] if "AS" in data else []
+            logger.info(f"ℹ️ Saran dari Bing: {suggestions[:SUGGESTION_LIMIT]}")
+            return suggestions[:SUGGESTION_LIMIT], len(suggestions) < SUGGESTION_LIMIT
+    except Exception as e:
+        logger.error(f"❌ Gagal mengambil saran dari Bing: {e}")
+        return None
 
+# Google dan Bing dipanggil bersamaan dengan satu deadline; yang belum selesai saat deadline dibatalkan.
+# Hasil hanya di-cache jika kedua provider menjawab, agar satu provider yang lambat tidak tertutup cache
+async def fetch_suggestions(query):
+    cached = await get_cached_suggestions(query)
+    if cached is not None:
+        return cached
+    tasks = [asyncio.create_task(fetch_google_suggestions(query)), asyncio.create_task(fetch_bing_suggestions(query))]
+    try:
+        done, pending = await asyncio.wait(tasks, timeout=SUGGESTION_DEADLINE)
+    finally:
+        for task in tasks:
+            task.cancel()
+    suggestions = []
+    answered = 0
+    complete = True
+    for task in tasks:
+        result = task.result() if task in done else None
+        if result is None:
+            continue
+        provider_suggestions, provider_complete = result
+        suggestions.extend(s for s in provider_suggestions if s not in suggestions)
+        answered += 1
+        complete = complete and provider_complete
+    if answered == len(tasks):
+        await cache_suggestions(query, suggestions, complete)
+    return suggestions
+
+# Hanya membaca; yang dicatat ke history cuma query yang sudah mengendap (lihat answer_inline_query)
 async def predict_markov(query):
     try:
-        predictions = set()
-        chat_history = load_chat_history()
         query_words = query.split()
-        if chat_history:
-            logger.info(f"ℹ️ Mengambil prediksi dari Redis untuk '{query}'")
-            for entry in chat_history:
-                if entry.startswith(query) and entry != query and len(predictions) < 4:
+        # Model n-gram lokal dulu; sebagian besar query inline selesai di sini tanpa memanggil Redis atau search engine
+        predictions = set(get_ngram_model().predict(query, limit=4))
+        # Prefix lookup di index autocomplete, diurutkan dari entri yang paling sering dipakai
+        if len(predictions) < 4:
+            for entry in await search_chat_history(query, limit=5):
+                if entry != query and len(predictions) < 4:
                     predictions.add(entry)
+        if predictions:
+            logger.info(f"ℹ️ {len(predictions)} prediksi lokal untuk '{query}'")
         if len(predictions) < 4:
-            logger.info(f"ℹ️ Prediksi dari Redis kurang dari 4, melengkapi dari search engine.")
-            google_preds = await fetch_google_suggestions(query)
-            bing_preds = await fetch_bing_suggestions(query)
-            all_preds = google_preds + bing_preds
-            for pred in all_preds:
+            logger.info(f"ℹ️ Prediksi lokal kurang dari 4, melengkapi dari search engine.")
+            for pred in await fetch_suggestions(query):
                 if (pred.startswith(query) and 
                     pred != query and 
                     pred not in predictions and 
                     len(pred.split()) > len(query_words) and
                     len(predictions) < 4):
                     predictions.add(pred)
-                    save_chat_history(pred)
         if len(predictions) < 4:
             logger.info(f"ℹ️ Prediksi masih kurang, menambahkan fallback akhir (second/baru).")
             fallback_preds = [f"{query} second", f"{query} baru"]
             for pred in fallback_preds:
                 if pred != query and pred not in predictions and len(predictions) < 4:
                     predictions.add(pred)
-                    save_chat_history(pred)
         return list(predictions)[:4]
     except Exception as e:
         logger.error(f"❌ Gagal memprediksi: {e}")
         return [f"{query} second", f"{query} baru"]
 
-def add_to_history(text):
+async def add_to_history(text):
     if len(text.split()) > 1:
-        save_chat_history(text)
+        await save_chat_history(text)
+        await train_ngram_model(text)
         logger.info(f"📌 Menambahkan '{text}' ke chat history di Redis")
 
 async def start(update: Update, context: CallbackContext):
-    await update.message.reply_text("Gunakan inline mode '@NamaBot <kata>' untuk prediksi teks atau kirim pertanyaan harga di chat.")
+    await outbound.reply(update.message, "Gunakan inline mode '@NamaBot <kata>' untuk prediksi teks atau kirim pertanyaan harga di chat.")
+
+# Satu task per user: query inline baru membatalkan task sebelumnya, sehingga hanya ketikan terakhir yang
+# diproses. Query dicatat ke history hanya jika tidak ada ketikan baru selama INLINE_SETTLE_DELAY
+async def answer_inline_query(inline_query, query):
+    try:
+        await asyncio.sleep(INLINE_DEBOUNCE)
+        predictions = await predict_markov(query)
+        results = [
+            InlineQueryResultArticle(
+                id=str(uuid.uuid4()),
+                title=pred,
+                input_message_content=InputTextMessageContent(pred),
+            ) for pred in predictions if pred
+        ]
+        if results:
+            await inline_query.answer(results, cache_time=1)
+        await asyncio.sleep(max(0, INLINE_SETTLE_DELAY - INLINE_DEBOUNCE))
+        await add_to_history(query)
+    except asyncio.CancelledError:
+        logger.debug(f"ℹ️ Query inline '{query}' digantikan query yang lebih baru")
+        raise
+    except Exception as e:
+        logger.error(f"❌ Gagal menjawab query inline '{query}': {e}")
+    finally:
+        if _inline_tasks.get(inline_query.from_user.id) is asyncio.current_task():
+            del _inline_tasks[inline_query.from_user.id]
 
 async def inline_query(update: Update, context: CallbackContext):
     query = update.inline_query.query.strip()
+    user_id = update.inline_query.from_user.id
+    previous = _inline_tasks.pop(user_id, None)
+    if previous is not None:
+        previous.cancel()
     if not query:
         return
-    add_to_history(query)
-    predictions = await predict_markov(query)
-    results = [
-        InlineQueryResultArticle(
-            id=str(uuid.uuid4()),
-            title=pred,
-            input_message_content=InputTextMessageContent(pred),
-        ) for pred in predictions if pred
-    ]
-    if results:
-        await update.inline_query.answer(results, cache_time=1)
+    _inline_tasks[user_id] = asyncio.create_task(answer_inline_query(update.inline_query, query))
 
+# Edit animasi tidak ditunggu: kalau chat sedang dibatasi, frame yang belum terkirim cukup ditimpa frame berikutnya
 async def animate_search_message(message, stop_event):
     dots = ["🔍 Mencari harga", "🔍 Mencari harga.", "🔍 Mencari harga..", "🔍 Mencari harga..."]
     idx = 0
     start_time = asyncio.get_event_loop().time()
+    reminded = False
+    last_edit = None
     while not stop_event.is_set():
-        try:
-            elapsed = asyncio.get_event_loop().time() - start_time
-            if 60 <= elapsed < 61:
-                await message.reply_text("Mohon tunggu, Bot masih berjalan")
-            await message.edit_text(dots[idx % 4])
-            idx += 1
-            await asyncio.sleep(1)
-        except BadRequest as e:
-            logger.debug(f"ℹ️ Pesan tidak dimodifikasi atau sudah dihapus: {e}")
-            break
-        except Exception as e:
-            logger.error(f"❌ Error tak terduga di animasi: {e}")
+        if last_edit is not None and last_edit.done() and last_edit.result() is False:
+            logger.debug("ℹ️ Pesan pencarian sudah tidak bisa diedit, animasi dihentikan")
             break
+        if not reminded and asyncio.get_event_loop().time() - start_time >= 60:
+            outbound.reply(message, "Mohon tunggu, Bot masih berjalan")
+            reminded = True
+        last_edit = outbound.edit(message, dots[idx % 4])
+        idx += 1
+        try:
+            await asyncio.wait_for(stop_event.wait(), timeout=1)
+        except asyncio.TimeoutError:
+            pass
+
+def format_price_range(record):
+    return f"Rp{format_rupiah(record.min)} - Rp{format_rupiah(record.max)}"
 
 async def handle_message(update: Update, context: CallbackContext):
     text = update.message.text.strip().lower()
     if is_price_question(text):
-        message = await update.message.reply_text("🔍 Mencari harga")
+        message = await outbound.reply(update.message, "🔍 Mencari harga")
+        if message is None:
+            return
         stop_event = asyncio.Event()
         animation_task = asyncio.create_task(animate_search_message(message, stop_event))
-        try:
-            normalized_query = normalize_price_query(text)
-            add_to_history(f"harga {normalized_query}")
-            prices = await asyncio.wait_for(scrape_price(normalized_query), timeout=180)
+
+        async def stop_animation():
             stop_event.set()
             await animation_task
-            if prices and prices["avg"] != "0":
-                answer = f"Kisaran Harga:\nMin: Rp{prices['min']}\nMax: Rp{prices['max']}\nRata-rata: Rp{prices['avg']}"
+
+        # Tampilkan agregat sementara begitu ada situs yang selesai, menggantikan animasi titik
+        async def report_progress(done, total, record):
+            if not record:
+                return
+            await stop_animation()
+            outbound.edit(message, f"🔍 {done}/{total} sumber: {format_price_range(record)}")
+
+        last_position = None
+
+        async def report_queue_position(position):
+            nonlocal last_position
+            if position == last_position:
+                return
+            last_position = position
+            await stop_animation()
+            status = "🔍 Mencari harga..." if position == 0 else f"⏳ Antrean ke-{position}, harga segera dicari..."
+            outbound.edit(message, status)
+
+        normalized_query = normalize_price_query(text)
+        ticket = admission.ticket(update.effective_user.id, update.effective_chat.id, on_position=report_queue_position)
+        try:
+            await add_to_history(f"harga {normalized_query}")
+            prices = await asyncio.wait_for(
+                scrape_price(normalized_query, on_progress=report_progress, admission_ticket=ticket), timeout=180
+            )
+            await stop_animation()
+            if prices:
+                answer = f"Kisaran Harga:\nMin: Rp{format_rupiah(prices.min)}\nMax: Rp{format_rupiah(prices.max)}\nRata-rata: Rp{format_rupiah(prices.avg)}"
             else:
                 answer = f"❌ Tidak dapat menemukan harga untuk '{normalized_query}'."
-            await message.edit_text(answer)
+            await outbound.edit(message, answer)
+        except AdmissionRejected as e:
+            await stop_animation()
+            await outbound.edit(message, admission_rejected_text(e))
         except asyncio.TimeoutError:
-            stop_event.set()
-            await animation_task
-            await message.edit_text(f"❌ Bot tidak bisa menemukan harga dari barang '{normalized_query}' dalam 3 menit.")
+            await stop_animation()
+            await outbound.edit(message, f"❌ Bot tidak bisa menemukan harga dari barang '{normalized_query}' dalam 3 menit.")
         except Exception as e:
-            stop_event.set()
-            await animation_task
-            await message.edit_text(f"❌ Terjadi kesalahan: {e}")
+            await stop_animation()
+            await outbound.edit(message, f"❌ Terjadi kesalahan: {e}")
     else:
-        await update.message.reply_text("Ini bukan pertanyaan harga. Fitur lain segera ditambahkan!")
+        await outbound.reply(update.message, "Ini bukan pertanyaan harga. Fitur lain segera ditambahkan!")
+
+def admission_rejected_text(error):
+    if error.reason == "rate_limited":
+        return f"⏳ Terlalu banyak permintaan harga. Coba lagi dalam {max(1, round(error.retry_after))} detik."
+    if error.reason == "timeout":
+        return "⏳ Antrean pencarian harga sedang panjang. Silakan coba lagi sebentar lagi."
+    return "🚦 Bot sedang sibuk mencari harga untuk banyak pengguna. Silakan coba lagi beberapa saat lagi."
 
 def is_price_question(text):
     price_keywords = ["harga", "berapa harga", "cari harga", "harga terbaru", "diskon", "best price", "murah", "mahal"]
     return any(keyword in text for keyword in price_keywords)
 
+def webhook_path():
+    if not TELEGRAM_WEBHOOK_URL:
+        return None
+    return urlparse(TELEGRAM_WEBHOOK_URL).path
+
+async def webhook_worker(telegram_app):
+    while True:
+        update = await _webhook_queue.get()
+        try:
+            await telegram_app.process_update(update)
+        except Exception as e:
+            logger.error(f"❌ Gagal memproses update {update.update_id}: {e}")
+        finally:
+            _webhook_queue.task_done()
+
+def start_webhook_workers(telegram_app):
+    global _webhook_queue
+    _webhook_queue = asyncio.Queue(maxsize=TELEGRAM_MAX_PENDING_UPDATES)
+    for _ in range(TELEGRAM_UPDATE_WORKERS):
+        _webhook_workers.append(asyncio.create_task(webhook_worker(telegram_app)))
+
+# False berarti antrean penuh: server membalas 503 dan Telegram mengirim ulang update itu nanti,
+# bisa ke instance lain di belakang load balancer
+def feed_webhook_update(telegram_app, payload):
+    if _webhook_queue is None:
+        return False
+    try:
+        _webhook_queue.put_nowait(Update.de_json(payload, telegram_app.bot))
+    except asyncio.QueueFull:
+        logger.warning(f"🚦 Antrean update webhook penuh ({TELEGRAM_MAX_PENDING_UPDATES}), update ditolak")
+        return False
+    return True
+
+async def stop_webhook_workers():
+    if _webhook_queue is not None and not _webhook_queue.empty():
+        try:
+            await asyncio.wait_for(_webhook_queue.join(), timeout=TELEGRAM_DRAIN_TIMEOUT)
+        except asyncio.TimeoutError:
+            logger.warning(f"⚠️ {_webhook_queue.qsize()} update webhook belum selesai diproses saat shutdown")
+    for task in _webhook_workers:
+        task.cancel()
+    _webhook_workers.clear()
+
+async def load_ngram_model_background():
+    try:
+        await load_ngram_model()
+    except redis.RedisError as e:
+        logger.error(f"❌ Gagal memuat model n-gram: {e}")
+
 async def run_telegram_bot(token):
+    global _ngram_load_task
+    await init_http_sessions()
+    get_parse_pool()
+    # Pelatihan ulang model bisa lama, jadi dijalankan di belakang agar tidak menahan update dan request web
+    _ngram_load_task = asyncio.create_task(load_ngram_model_background())
     if not token:
         logger.error("❌ TELEGRAM_BOT_TOKEN tidak ditemukan!")
         return None
 
-    telegram_app = Application.builder().token(token).build()
+    telegram_app = Application.builder().token(token).concurrent_updates(TELEGRAM_UPDATE_WORKERS).build()
     telegram_app.add_handler(CommandHandler("start", start))
     telegram_app.add_handler(InlineQueryHandler(inline_query))
-    telegram_app.add_handler(MessageHandler(filters.TEXT, handle_message))
+    # Pertanyaan harga bisa menunggu antrean admission dan scraping sampai 3 menit, jadi dijalankan sebagai task
+    # yang dilacak Application; worker update langsung bebas untuk update berikutnya (inline query, /start)
+    telegram_app.add_handler(MessageHandler(filters.TEXT, handle_message, block=False))
 
     await telegram_app.initialize()
     await telegram_app.start()
+    if TELEGRAM_WEBHOOK_URL:
+        try:
+            await telegram_app.bot.set_webhook(
+                TELEGRAM_WEBHOOK_URL,
+                secret_token=TELEGRAM_WEBHOOK_SECRET,
+                max_connections=TELEGRAM_WEBHOOK_MAX_CONNECTIONS,
+                allowed_updates=Update.ALL_TYPES,
+            )
+            start_webhook_workers(telegram_app)
+            logger.info(f"✅ Webhook Telegram terpasang di {TELEGRAM_WEBHOOK_URL} dengan {TELEGRAM_UPDATE_WORKERS} worker")
+            return telegram_app
+        except TelegramError as e:
+            logger.error(f"❌ Gagal memasang webhook, kembali ke polling: {e}")
+    # start_polling menghapus webhook yang masih terpasang sebelum mulai mengambil update
     await telegram_app.updater.start_polling()
+    logger.info("✅ Bot Telegram berjalan dengan polling")
     return telegram_app
 
 async def shutdown_telegram(telegram_app):
     if telegram_app:
         logger.info("🛑 Memulai proses shutdown bot Telegram...")
+        # Webhook sengaja tidak dihapus karena instance lain di belakang load balancer masih melayaninya
+        await stop_webhook_workers()
+        if telegram_app.updater and telegram_app.updater.running:
+            await telegram_app.updater.stop()
         await telegram_app.stop()
         await telegram_app.shutdown()
-        logger.info("✅ Shutdown bot Telegram selesai.")
\ No newline at end of file
+        logger.info("✅ Shutdown bot Telegram selesai.")
+    for task in list(_inline_tasks.values()):
+        task.cancel()
+    if _ngram_load_task:
+        _ngram_load_task.cancel()
+    await outbound.close()
+    try:
+        await save_ngram_model()
+    except redis.RedisError as e:
+        logger.error(f"❌ Gagal menyimpan model n-gram: {e}")
+    await close_http_sessions()
+    shutdown_parse_pool()
+    await close_redis()
\ No newline at end of file
@@ -0,0 +1,32 @@
+import json
+import os
+from redis_store import redis_client
+
+DASHBOARD_EVENTS_KEY = "dashboard_events"
+DASHBOARD_EVENTS_MAXLEN = int(os.getenv("DASHBOARD_EVENTS_MAXLEN", 5000))
+
+# Perubahan data yang tampil di dashboard (proxy, chat history, price history) dicatat ke stream
+# dashboard_events agar dashboard cukup menerima delta, bukan mengambil ulang seluruh list/hash.
+# kind: "proxy" | "chat_history" | "price_history", action: "add" | "remove"
+def _event_fields(kind, action, keys, values=None):
+    fields = {"kind": kind, "action": action, "keys": json.dumps(keys)}
+    if values is not None:
+        fields["values"] = json.dumps(values)
+    return fields
+
+# Ikut dikirim bersama pipeline pemanggil, sama seperti index_price_key
+def queue_dashboard_event(pipe, kind, action, keys, values=None):
+    if keys:
+        pipe.xadd(DASHBOARD_EVENTS_KEY, _event_fields(kind, action, keys, values), maxlen=DASHBOARD_EVENTS_MAXLEN, approximate=True)
+
+async def publish_dashboard_event(kind, action, keys, values=None):
+    if keys:
+        await redis_client.xadd(DASHBOARD_EVENTS_KEY, _event_fields(kind, action, keys, values), maxlen=DASHBOARD_EVENTS_MAXLEN, approximate=True)
+
+def parse_dashboard_event(fields):
+    return {
+        "kind": fields["kind"],
+        "action": fields["action"],
+        "keys": json.loads(fields["keys"]),
+        "values": json.loads(fields["values"]) if "values" in fields else None,
+    }
@@ -0,0 +1,143 @@
+import asyncio
+import json
+import logging
+import os
+import redis
+from dashboard_events import DASHBOARD_EVENTS_KEY, parse_dashboard_event
+from log_store import LOG_STREAM_KEY, read_logs, log_entry, log_level
+from parse_pool import parse_metrics_snapshot
+from proxy_pool import count_proxies, list_proxies
+from proxy_scraper import proxy_source_stats
+from redis_store import redis_client, check_redis_connection
+from site_health import site_health_snapshot
+from utils import count_chat_history, load_chat_history, load_price_history
+
+DASHBOARD_COUNTER_INTERVAL = float(os.getenv("DASHBOARD_COUNTER_INTERVAL", 5))
+# Harus lebih pendek dari REDIS_SOCKET_TIMEOUT karena XREAD BLOCK menahan koneksi selama menunggu
+DASHBOARD_BLOCK_SECONDS = float(os.getenv("DASHBOARD_BLOCK_SECONDS", 2))
+DASHBOARD_CLIENT_BUFFER = int(os.getenv("DASHBOARD_CLIENT_BUFFER", 1000))
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+async def collect_counters():
+    try:
+        redis_status = "Connected" if await check_redis_connection() else "Disconnected"
+        proxy_count, chat_history_count, price_history_count, proxy_sources, parse_metrics = await asyncio.gather(
+            count_proxies(), count_chat_history(), redis_client.hlen("price_history"), proxy_source_stats(),
+            parse_metrics_snapshot(),
+        )
+    except redis.RedisError:
+        return {"redis_status": "Disconnected"}
+    return {
+        "redis_status": redis_status,
+        "proxy_count": proxy_count,
+        "chat_history_count": chat_history_count,
+        "price_history_count": price_history_count or 0,
+        "proxy_sources": proxy_sources,
+        "parse_metrics": parse_metrics,
+        # Status circuit breaker milik proses ini; pada SCRAPE_MODE=queue scraping berjalan di scrape worker
+        "site_health": site_health_snapshot(),
+    }
+
+def price_history_display(records):
+    return {key: json.dumps(record.to_display()) for key, record in records.items() if record}
+
+async def build_snapshot(min_level):
+    counters = await collect_counters()
+    logs, log_cursor = await read_logs(None, min_level)
+    proxies, chat_history, price_history = await asyncio.gather(list_proxies(), load_chat_history(), load_price_history())
+    return {
+        "counters": counters,
+        "logs": logs,
+        "log_cursor": log_cursor,
+        "proxies": proxies,
+        "chat_history": chat_history,
+        "price_history": price_history_display(price_history),
+    }
+
+class DashboardClient:
+    def __init__(self, min_level):
+        self.min_level = min_level
+        self.queue = asyncio.Queue(maxsize=DASHBOARD_CLIENT_BUFFER)
+
+    def send(self, event):
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except asyncio.QueueFull:
+            return False
+
+# Satu task per proses membaca stream logs dan dashboard_events lalu membagikannya ke semua dashboard yang
+# terhubung, jadi jumlah koneksi Redis tidak bertambah mengikuti jumlah dashboard. Counter dihitung sekali
+# per DASHBOARD_COUNTER_INTERVAL dan hanya dikirim saat nilainya berubah.
+class DashboardHub:
+    def __init__(self):
+        self.clients = set()
+        self.task = None
+        self.counters = None
+
+    def subscribe(self, min_level):
+        client = DashboardClient(min_level)
+        self.clients.add(client)
+        if self.task is None or self.task.done():
+            self.task = asyncio.create_task(self._run())
+        return client
+
+    def unsubscribe(self, client):
+        self.clients.discard(client)
+
+    def _broadcast(self, event, data, level=None):
+        for client in list(self.clients):
+            if level is not None and level < client.min_level:
+                continue
+            # Dashboard yang tertinggal terlalu jauh diputus; saat tersambung ulang ia mendapat snapshot baru
+            if not client.send((event, data)):
+                logger.warning("⚠️ Dashboard terlalu lambat menerima event, koneksi diputus")
+                self.clients.discard(client)
+                client.queue.get_nowait()
+                client.send(None)
+
+    async def _last_id(self, key):
+        entries = await redis_client.xrevrange(key, count=1)
+        return entries[0][0] if entries else "0-0"
+
+    async def _refresh_counters(self):
+        counters = await collect_counters()
+        if counters != self.counters:
+            self.counters = counters
+            self._broadcast("counters", counters)
+
+    async def _run(self):
+        streams = None
+        loop = asyncio.get_running_loop()
+        next_counters = 0
+        while self.clients:
+            try:
+                if loop.time() >= next_counters:
+                    await self._refresh_counters()
+                    next_counters = loop.time() + DASHBOARD_COUNTER_INTERVAL
+                if streams is None:
+                    streams = {DASHBOARD_EVENTS_KEY: await self._last_id(DASHBOARD_EVENTS_KEY), LOG_STREAM_KEY: await self._last_id(LOG_STREAM_KEY)}
+                block = max(0.1, min(DASHBOARD_BLOCK_SECONDS, next_counters - loop.time()))
+                response = await redis_client.xread(streams, block=int(block * 1000))
+            except redis.RedisError as e:
+                logger.warning(f"⚠️ Gagal membaca event dashboard dari Redis: {e}")
+                await asyncio.sleep(1)
+                continue
+            for stream, entries in response or []:
+                streams[stream] = entries[-1][0]
+                for entry_id, fields in entries:
+                    if stream == LOG_STREAM_KEY:
+                        self._broadcast("log", log_entry(entry_id, fields), level=log_level(fields))
+                    else:
+                        self._broadcast("change", parse_dashboard_event(fields))
+
+    async def close(self):
+        for client in list(self.clients):
+            client.send(None)
+        self.clients.clear()
+        if self.task:
+            self.task.cancel()
+
+dashboard_hub = DashboardHub()
@@ -0,0 +1,147 @@
+import aiohttp
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+HTTP_POOL_LIMIT = int(os.getenv("HTTP_POOL_LIMIT", 100))
+HTTP_POOL_LIMIT_PER_HOST = int(os.getenv("HTTP_POOL_LIMIT_PER_HOST", 10))
+HTTP_DNS_CACHE_TTL = int(os.getenv("HTTP_DNS_CACHE_TTL", 300))
+HTTP_KEEPALIVE_TIMEOUT = float(os.getenv("HTTP_KEEPALIVE_TIMEOUT", 30))
+HTTP_MAX_PROXY_POOLS = int(os.getenv("HTTP_MAX_PROXY_POOLS", 50))
+PROXY_VALIDATION_CONCURRENCY = int(os.getenv("PROXY_VALIDATION_CONCURRENCY", 100))
+STICKY_SESSION_LIFETIME = float(os.getenv("STICKY_SESSION_LIFETIME", 10 * 60))
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+# Satu session untuk koneksi langsung (key None), satu pool per proxy, dan satu per (situs, proxy) untuk
+# sesi sticky yang cookie jar-nya terpisah per situs. Semua diurutkan LRU
+_sessions = OrderedDict()
+_session_expiry = {}
+_sticky_proxies = {}
+_validation_session = None
+# Session yang sudah dikeluarkan dari _sessions (LRU atau kedaluwarsa) baru ditutup setelah request terakhir
+# yang memakainya selesai, agar request lain di situs yang sama tidak ikut gagal
+_in_use = {}
+_retired = set()
+_close_tasks = set()
+
+def _close_later(session):
+    _retired.discard(session)
+    if session.closed:
+        return
+    task = asyncio.create_task(session.close())
+    _close_tasks.add(task)
+    task.add_done_callback(_close_tasks.discard)
+
+def _retire(session):
+    if _in_use.get(session):
+        _retired.add(session)
+    else:
+        _close_later(session)
+
+def _create_session(proxy=None):
+    connector = aiohttp.TCPConnector(
+        limit=HTTP_POOL_LIMIT,
+        limit_per_host=HTTP_POOL_LIMIT_PER_HOST,
+        use_dns_cache=True,
+        ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+        keepalive_timeout=HTTP_KEEPALIVE_TIMEOUT,
+    )
+    return aiohttp.ClientSession(connector=connector, proxy=f"http://{proxy}" if proxy else None)
+
+def _pooled_session(key, proxy):
+    session = _sessions.get(key)
+    if session is None or session.closed:
+        session = _create_session(proxy)
+        _sessions[key] = session
+        if proxy:
+            logger.debug(f"ℹ️ Membuat pool koneksi baru untuk {key}")
+    _sessions.move_to_end(key)
+    proxy_pools = [key for key in _sessions if key is not None]
+    while len(proxy_pools) > HTTP_MAX_PROXY_POOLS:
+        oldest = proxy_pools.pop(0)
+        _session_expiry.pop(oldest, None)
+        _retire(_sessions.pop(oldest))
+    return session
+
+def get_session(proxy=None):
+    return _pooled_session(proxy, proxy)
+
+# Sesi sticky: situs memakai proxy dan cookie yang sama sampai STICKY_SESSION_LIFETIME habis atau proxy gagal,
+# sehingga marketplace melihat satu "pengunjung" yang konsisten alih-alih IP dan cookie yang terus berganti
+def get_sticky_proxy(site):
+    sticky = _sticky_proxies.get(site)
+    if sticky is None or time.monotonic() > sticky[1]:
+        return None
+    return sticky[0]
+
+def get_site_session(site, proxy):
+    key = (site, proxy)
+    now = time.monotonic()
+    if _session_expiry.get(key, 0) <= now:
+        # Sesi baru atau sudah kedaluwarsa: mulai cookie jar baru
+        expired = _sessions.pop(key, None)
+        if expired is not None:
+            _retire(expired)
+        _session_expiry[key] = now + STICKY_SESSION_LIFETIME
+    _sticky_proxies[site] = (proxy, _session_expiry[key])
+    return _pooled_session(key, proxy)
+
+# Dipakai sebagai context manager selama request berjalan, sehingga session tidak ditutup di tengah request
+@asynccontextmanager
+async def site_session(site, proxy=None):
+    session = get_site_session(site, proxy) if proxy else get_session()
+    _in_use[session] = _in_use.get(session, 0) + 1
+    try:
+        yield session
+    finally:
+        _in_use[session] -= 1
+        if not _in_use[session]:
+            del _in_use[session]
+            if session in _retired:
+                _close_later(session)
+
+async def release_site_session(site, proxy):
+    if _sticky_proxies.get(site, (None,))[0] == proxy:
+        del _sticky_proxies[site]
+    _session_expiry.pop((site, proxy), None)
+    session = _sessions.pop((site, proxy), None)
+    if session is not None:
+        _retire(session)
+
+# Validasi proxy memakai connector sendiri: tiap proxy hanya dites sekali, jadi koneksi langsung ditutup
+# dan batas koneksinya sama dengan batas konkurensi validasi agar tidak menghabiskan file descriptor
+def get_validation_session():
+    global _validation_session
+    if _validation_session is None or _validation_session.closed:
+        connector = aiohttp.TCPConnector(
+            limit=PROXY_VALIDATION_CONCURRENCY,
+            force_close=True,
+            use_dns_cache=True,
+            ttl_dns_cache=HTTP_DNS_CACHE_TTL,
+        )
+        _validation_session = aiohttp.ClientSession(connector=connector)
+    return _validation_session
+
+async def init_http_sessions():
+    get_session()
+    logger.info(f"✅ HTTP session pool siap (limit {HTTP_POOL_LIMIT}, per host {HTTP_POOL_LIMIT_PER_HOST})")
+
+async def close_http_sessions():
+    global _validation_session
+    sessions = list(_sessions.values())
+    _sessions.clear()
+    _session_expiry.clear()
+    _sticky_proxies.clear()
+    sessions.extend(_retired)
+    _retired.clear()
+    _in_use.clear()
+    if _validation_session is not None:
+        sessions.append(_validation_session)
+        _validation_session = None
+    await asyncio.gather(*_close_tasks, *(session.close() for session in sessions if not session.closed), return_exceptions=True)
+    logger.info(f"✅ {len(sessions)} HTTP session ditutup")
@@ -0,0 +1,105 @@
+import asyncio
+import logging
+import os
+import socket
+from collections import deque
+import redis
+from redis_store import redis_client
+
+LOG_STREAM_KEY = "logs"
+LOG_STREAM_MAXLEN = int(os.getenv("LOG_STREAM_MAXLEN", 2000))
+LOG_FLUSH_INTERVAL = float(os.getenv("LOG_FLUSH_INTERVAL", 1))
+# Batas antrean lokal selama Redis tidak bisa dihubungi; log yang tidak muat dibuang
+LOG_LOCAL_BUFFER = int(os.getenv("LOG_LOCAL_BUFFER", 1000))
+LOG_READ_LIMIT = int(os.getenv("LOG_READ_LIMIT", 200))
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+# Handler logging bersifat sinkron dan bisa dipanggil dari thread lain, jadi emit hanya menaruh record di deque.
+# Task run_log_shipper mengirimnya ke stream Redis secara batch, dan MAXLEN membuat stream itu jadi ring buffer
+# yang dibaca bersama oleh semua proses (bot dan scrape worker).
+class RedisLogHandler(logging.Handler):
+    def __init__(self, source, level=logging.INFO):
+        super().__init__(level)
+        self.source = source
+        self.pending = deque(maxlen=LOG_LOCAL_BUFFER)
+
+    def emit(self, record):
+        try:
+            message = record.getMessage()
+            if record.exc_info:
+                message = f"{message}\n{logging.Formatter().formatException(record.exc_info)}"
+            self.pending.append({
+                "ts": record.created,
+                "level": record.levelname,
+                "levelno": record.levelno,
+                "logger": record.name,
+                "source": self.source,
+                "message": message,
+            })
+        except Exception:
+            self.handleError(record)
+
+    async def flush_to_redis(self):
+        if not self.pending:
+            return
+        batch = []
+        while self.pending:
+            batch.append(self.pending.popleft())
+        pipe = redis_client.pipeline(transaction=False)
+        for entry in batch:
+            pipe.xadd(LOG_STREAM_KEY, entry, maxlen=LOG_STREAM_MAXLEN, approximate=True)
+        try:
+            await pipe.execute()
+        except redis.RedisError:
+            # Kembalikan ke antrean agar dicoba lagi; tidak di-log supaya tidak memicu log baru terus-menerus
+            self.pending.extendleft(reversed(batch))
+
+_handler = None
+
+def install_log_handler(source=None):
+    global _handler
+    if _handler is None:
+        _handler = RedisLogHandler(source or f"{socket.gethostname()}-{os.getpid()}")
+        logging.getLogger().addHandler(_handler)
+    return _handler
+
+async def run_log_shipper():
+    while True:
+        await asyncio.sleep(LOG_FLUSH_INTERVAL)
+        await _handler.flush_to_redis()
+
+async def flush_logs():
+    if _handler is not None:
+        await _handler.flush_to_redis()
+
+def parse_log_level(name):
+    level = logging.getLevelName(name.upper()) if name else logging.NOTSET
+    return level if isinstance(level, int) else None
+
+def log_level(fields):
+    return int(fields.get("levelno", 0))
+
+def log_entry(entry_id, fields):
+    return {
+        "id": entry_id,
+        "ts": float(fields["ts"]),
+        "level": fields["level"],
+        "source": fields.get("source"),
+        "message": fields["message"],
+    }
+
+# Tanpa cursor: kembalikan log terbaru. Dengan cursor: hanya entri setelah cursor itu. Cursor berikutnya
+# adalah entri terakhir yang dipindai, termasuk yang tersaring level, agar entri itu tidak dipindai ulang
+async def read_logs(cursor=None, min_level=logging.NOTSET, limit=LOG_READ_LIMIT):
+    if cursor:
+        entries = await redis_client.xrange(LOG_STREAM_KEY, min=f"({cursor}", count=limit)
+    else:
+        entries = list(reversed(await redis_client.xrevrange(LOG_STREAM_KEY, count=limit)))
+    logs = [log_entry(entry_id, fields) for entry_id, fields in entries if log_level(fields) >= min_level]
+    next_cursor = entries[-1][0] if entries else cursor
+    return logs, next_cursor
+
+async def clear_logs():
+    await redis_client.delete(LOG_STREAM_KEY)
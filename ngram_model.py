@@ -0,0 +1,205 @@
+import asyncio
+import heapq
+import logging
+import os
+import re
+from array import array
+from bisect import bisect_left, insort
+import msgpack
+from redis_store import redis_client, redis_binary_client
+
+NGRAM_ORDER = int(os.getenv("NGRAM_ORDER", 3))
+NGRAM_SAVE_EVERY = int(os.getenv("NGRAM_SAVE_EVERY", 50))
+NGRAM_MODEL_KEY = "ngram_model"
+NGRAM_MODEL_VERSION = 1
+# Saat melatih ulang dari history, event loop diberi giliran setiap sekian entri
+NGRAM_REBUILD_YIELD_EVERY = int(os.getenv("NGRAM_REBUILD_YIELD_EVERY", 500))
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+def tokenize(text):
+    return re.findall(r"\w+", text.lower())
+
+# Kata yang belum pernah dilihat memutus konteks, jadi hanya id setelah kata tak dikenal terakhir yang dipakai
+def known_suffix(ids):
+    for i in range(len(ids) - 1, -1, -1):
+        if ids[i] is None:
+            return ids[i + 1:]
+    return ids
+
+# Model n-gram dengan backoff. Token disimpan sebagai id integer, dan untuk setiap konteks (tuple id,
+# panjang 0 sampai order-1) disimpan dua array paralel: id token berikutnya dan jumlah kemunculannya.
+# Posisi token di array dicari lewat map token -> slot yang dibuat saat konteks itu pertama kali dilatih,
+# dan kosakata terurut dipakai untuk mencari kata berawalan tertentu dengan bisect
+class NgramModel:
+    def __init__(self, order=NGRAM_ORDER):
+        self.order = order
+        self.vocab = {}
+        self.tokens = []
+        self.sorted_tokens = []
+        self.transitions = {}
+        self.slots = {}
+        self.pending = 0
+
+    def _token_id(self, token):
+        token_id = self.vocab.get(token)
+        if token_id is None:
+            token_id = self.vocab[token] = len(self.tokens)
+            self.tokens.append(token)
+            insort(self.sorted_tokens, token)
+        return token_id
+
+    def _slots(self, context):
+        slots = self.slots.get(context)
+        if slots is None:
+            next_ids, _ = self.transitions.setdefault(context, (array("I"), array("I")))
+            slots = self.slots[context] = {token_id: slot for slot, token_id in enumerate(next_ids)}
+        return slots
+
+    def train(self, text, count=1):
+        ids = [self._token_id(token) for token in tokenize(text)]
+        for i, token_id in enumerate(ids):
+            for n in range(min(i, self.order - 1) + 1):
+                context = tuple(ids[i - n:i])
+                slots = self._slots(context)
+                next_ids, counts = self.transitions[context]
+                slot = slots.get(token_id)
+                if slot is None:
+                    slots[token_id] = len(next_ids)
+                    next_ids.append(token_id)
+                    counts.append(count)
+                else:
+                    counts[slot] += count
+        self.pending += 1
+
+    def _prefix_ids(self, prefix):
+        start = bisect_left(self.sorted_tokens, prefix)
+        for token in self.sorted_tokens[start:]:
+            if not token.startswith(prefix):
+                break
+            if token != prefix:
+                yield self.vocab[token]
+
+    # prefix=None berarti prediksi kata berikutnya; selain itu hanya kata yang melengkapi prefix tersebut
+    def _candidates(self, context_ids, limit, prefix=None):
+        # Backoff: konteks terpanjang yang punya kandidat dipakai, lalu mundur ke konteks lebih pendek
+        for n in range(min(len(context_ids), self.order - 1), -1, -1):
+            context = tuple(context_ids[len(context_ids) - n:])
+            entry = self.transitions.get(context)
+            if entry is None:
+                continue
+            next_ids, counts = entry
+            if prefix is None:
+                pairs = zip(counts, next_ids)
+            elif n == 0:
+                # Konteks kosong berisi seluruh kosakata, jadi kandidat diambil dari rentang prefix saja
+                slots = self._slots(context)
+                pairs = ((counts[slots[token_id]], token_id) for token_id in self._prefix_ids(prefix))
+            else:
+                pairs = (
+                    (count, token_id) for token_id, count in zip(next_ids, counts)
+                    if self.tokens[token_id].startswith(prefix) and self.tokens[token_id] != prefix
+                )
+            ranked = heapq.nlargest(limit, pairs)
+            if ranked:
+                return [self.tokens[token_id] for _, token_id in ranked]
+        return []
+
+    def predict(self, text, limit=4):
+        words = tokenize(text)
+        if not words:
+            return []
+        context_ids = [self.vocab.get(word) for word in words]
+        predictions = []
+        last = words[-1]
+        if text.lower().endswith(last):
+            # Kata terakhir mungkin belum selesai diketik: lengkapi dari kata yang diawali prefix tersebut
+            head = text[:len(text) - len(last)]
+            context = known_suffix(context_ids[:-1])
+            for token in self._candidates(context, limit, prefix=last):
+                predictions.append(head + token)
+            if len(predictions) >= limit:
+                return predictions
+        if context_ids[-1] is not None:
+            head = text.rstrip() + " "
+            context_ids = known_suffix(context_ids)
+            for token in self._candidates(context_ids, limit - len(predictions)):
+                predictions.append(head + token)
+        return predictions
+
+    def pack(self):
+        contexts = [
+            [list(context), next_ids.tobytes(), counts.tobytes()] for context, (next_ids, counts) in self.transitions.items()
+        ]
+        return msgpack.packb([NGRAM_MODEL_VERSION, self.order, self.tokens, contexts])
+
+    @classmethod
+    def unpack(cls, data):
+        version, order, tokens, contexts = msgpack.unpackb(data)
+        if version != NGRAM_MODEL_VERSION:
+            raise ValueError(f"Versi model n-gram tidak dikenal: {version}")
+        model = cls(order)
+        model.tokens = tokens
+        model.vocab = {token: token_id for token_id, token in enumerate(tokens)}
+        model.sorted_tokens = sorted(tokens)
+        for context, next_ids, counts in contexts:
+            next_array, count_array = array("I"), array("I")
+            next_array.frombytes(next_ids)
+            count_array.frombytes(counts)
+            model.transitions[tuple(context)] = (next_array, count_array)
+        return model
+
+_model = None
+# Snapshot baru boleh ditulis setelah model selesai dimuat, agar model yang masih dilatih ulang tidak menimpanya
+_model_ready = False
+
+# Model dimuat dari snapshot Redis; jika belum ada, dilatih dari chat history (dibobot frekuensi) dan key price_history.
+# Pelatihan ulang mengisi model yang sudah dipakai prediksi secara bertahap dan memberi giliran ke event loop
+async def load_ngram_model():
+    global _model, _model_ready
+    data = await redis_binary_client.get(NGRAM_MODEL_KEY)
+    if data is not None:
+        try:
+            _model = NgramModel.unpack(data)
+            _model_ready = True
+            logger.info(f"✅ Model n-gram dimuat ({len(_model.tokens)} token, {len(_model.transitions)} konteks)")
+            return _model
+        except (ValueError, msgpack.ExtraData) as e:
+            logger.warning(f"⚠️ Snapshot model n-gram tidak valid, melatih ulang: {e}")
+    model = get_ngram_model()
+    trained = 0
+    async for text, count in redis_client.zscan_iter("chat_history:freq"):
+        model.train(text, int(count))
+        trained += 1
+        if trained % NGRAM_REBUILD_YIELD_EVERY == 0:
+            await asyncio.sleep(0)
+    # HKEYS, bukan HSCAN NOVALUES yang baru ada di Redis 7.4; nilai price_history biner dan tidak diperlukan
+    for key in await redis_client.hkeys("price_history"):
+        model.train(key)
+        trained += 1
+        if trained % NGRAM_REBUILD_YIELD_EVERY == 0:
+            await asyncio.sleep(0)
+    _model_ready = True
+    await save_ngram_model()
+    logger.info(f"✅ Model n-gram dilatih dari history ({len(_model.tokens)} token, {len(_model.transitions)} konteks)")
+    return _model
+
+# Model kosong dipakai selama snapshot belum dimuat, agar prediksi tidak pernah menunggu Redis
+def get_ngram_model():
+    global _model
+    if _model is None:
+        _model = NgramModel()
+    return _model
+
+async def save_ngram_model():
+    if _model is None or not _model_ready:
+        return
+    await redis_binary_client.set(NGRAM_MODEL_KEY, _model.pack())
+    _model.pending = 0
+
+async def train_ngram_model(text):
+    model = get_ngram_model()
+    model.train(text)
+    if model.pending >= NGRAM_SAVE_EVERY:
+        await save_ngram_model()
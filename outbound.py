@@ -0,0 +1,174 @@
+import asyncio
+import logging
+import os
+import time
+from collections import OrderedDict, deque
+from datetime import timedelta
+from telegram.error import BadRequest, RetryAfter, TelegramError
+from admission import TokenBucket
+
+OUTBOUND_GLOBAL_RATE = float(os.getenv("OUTBOUND_GLOBAL_RATE", 25))
+OUTBOUND_PRIVATE_INTERVAL = float(os.getenv("OUTBOUND_PRIVATE_INTERVAL", 1))
+OUTBOUND_GROUP_INTERVAL = float(os.getenv("OUTBOUND_GROUP_INTERVAL", 3))
+OUTBOUND_MAX_INTERVAL = float(os.getenv("OUTBOUND_MAX_INTERVAL", 30))
+OUTBOUND_RECOVERY = float(os.getenv("OUTBOUND_RECOVERY", 0.8))
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+def retry_after_seconds(error):
+    if isinstance(error.retry_after, timedelta):
+        return error.retry_after.total_seconds()
+    return float(error.retry_after)
+
+# Antrean keluar satu chat. Edit untuk pesan yang sama digabung (teks terakhir yang dikirim), reply dikirim berurutan
+class ChatOutbox:
+    def __init__(self, base_interval):
+        self.base_interval = base_interval
+        self.interval = base_interval
+        self.next_at = 0.0
+        self.busy = False
+        self.replies = deque()
+        # message_id -> [message, text, futures]
+        self.edits = OrderedDict()
+
+    def has_work(self):
+        return bool(self.replies or self.edits)
+
+    def is_idle(self, now):
+        return not self.busy and not self.has_work() and self.interval == self.base_interval and self.next_at <= now
+
+    def pop(self):
+        if self.replies:
+            message, text, future = self.replies.popleft()
+            return "reply", message, text, [future]
+        _, (message, text, futures) = self.edits.popitem(last=False)
+        return "edit", message, text, futures
+
+    def requeue(self, kind, message, text, futures):
+        if kind == "reply":
+            self.replies.appendleft((message, text, futures[0]))
+            return
+        pending = self.edits.get(message.message_id)
+        if pending:
+            # Sudah ada teks yang lebih baru untuk pesan ini, teks lama cukup dibuang
+            pending[2].extend(futures)
+            return
+        self.edits[message.message_id] = [message, text, futures]
+        self.edits.move_to_end(message.message_id, last=False)
+
+# Semua edit dan reply ke Telegram lewat sini agar tidak kena flood limit: tiap chat punya jarak minimum antar
+# pesan (lebih longgar untuk grup), ada batas global per detik, dan RetryAfter membuat chat itu dijeda sekaligus
+# memperbesar jaraknya, yang lalu pulih perlahan setiap pengiriman sukses.
+class OutboundScheduler:
+    def __init__(self):
+        self.chats = {}
+        self.global_bucket = TokenBucket(OUTBOUND_GLOBAL_RATE, OUTBOUND_GLOBAL_RATE)
+        self.wakeup = None
+        self.dispatcher = None
+
+    def _outbox(self, chat):
+        outbox = self.chats.get(chat.id)
+        if outbox is None:
+            interval = OUTBOUND_GROUP_INTERVAL if chat.type in ("group", "supergroup", "channel") else OUTBOUND_PRIVATE_INTERVAL
+            outbox = self.chats[chat.id] = ChatOutbox(interval)
+        return outbox
+
+    def _wake(self):
+        if self.dispatcher is None or self.dispatcher.done():
+            self.wakeup = asyncio.Event()
+            self.dispatcher = asyncio.create_task(self._dispatch_loop())
+        self.wakeup.set()
+
+    # Hasil future: True jika teks sudah tampil, False jika pesan tidak bisa diedit lagi
+    def edit(self, message, text):
+        future = asyncio.get_running_loop().create_future()
+        outbox = self._outbox(message.chat)
+        pending = outbox.edits.get(message.message_id)
+        if pending:
+            pending[1] = text
+            pending[2].append(future)
+        else:
+            outbox.edits[message.message_id] = [message, text, [future]]
+        self._wake()
+        return future
+
+    # Hasil future: Message yang terkirim, atau None jika gagal
+    def reply(self, message, text):
+        future = asyncio.get_running_loop().create_future()
+        self._outbox(message.chat).replies.append((message, text, future))
+        self._wake()
+        return future
+
+    async def _dispatch_loop(self):
+        while True:
+            self.wakeup.clear()
+            now = time.monotonic()
+            wait = None
+            for chat_id, outbox in list(self.chats.items()):
+                if outbox.is_idle(now):
+                    del self.chats[chat_id]
+                    continue
+                if outbox.busy or not outbox.has_work():
+                    continue
+                if outbox.next_at > now:
+                    wait = min(wait, outbox.next_at - now) if wait is not None else outbox.next_at - now
+                    continue
+                if not self.global_bucket.available():
+                    retry = self.global_bucket.retry_after()
+                    wait = min(wait, retry) if wait is not None else retry
+                    break
+                self.global_bucket.take()
+                outbox.busy = True
+                outbox.next_at = now + outbox.interval
+                # Chat yang baru dilayani pindah ke belakang agar jatah global terbagi rata
+                self.chats[chat_id] = self.chats.pop(chat_id)
+                asyncio.create_task(self._send(outbox, *outbox.pop()))
+            try:
+                await asyncio.wait_for(self.wakeup.wait(), timeout=wait)
+            except asyncio.TimeoutError:
+                pass
+
+    async def _send(self, outbox, kind, message, text, futures):
+        result = False if kind == "edit" else None
+        try:
+            if kind == "edit":
+                await message.edit_text(text)
+                result = True
+            else:
+                result = await message.reply_text(text)
+            outbox.interval = max(outbox.base_interval, outbox.interval * OUTBOUND_RECOVERY)
+        except RetryAfter as e:
+            delay = retry_after_seconds(e)
+            outbox.interval = min(OUTBOUND_MAX_INTERVAL, outbox.interval * 2)
+            outbox.next_at = time.monotonic() + delay
+            outbox.requeue(kind, message, text, futures)
+            logger.warning(f"🐢 Telegram membatasi chat {message.chat_id}, jeda {delay:.0f} detik (jarak pesan {outbox.interval:.1f} detik)")
+            return
+        except BadRequest as e:
+            if "not modified" in str(e).lower():
+                result = True
+            else:
+                logger.debug(f"ℹ️ Pesan tidak bisa dikirim atau sudah dihapus: {e}")
+        except TelegramError as e:
+            logger.error(f"❌ Gagal mengirim pesan ke chat {message.chat_id}: {e}")
+        finally:
+            outbox.busy = False
+            self.wakeup.set()
+        for future in futures:
+            if not future.done():
+                future.set_result(result)
+
+    async def close(self):
+        if self.dispatcher:
+            self.dispatcher.cancel()
+            self.dispatcher = None
+        for outbox in self.chats.values():
+            while outbox.has_work():
+                kind, _, _, futures = outbox.pop()
+                for future in futures:
+                    if not future.done():
+                        future.set_result(False if kind == "edit" else None)
+        self.chats.clear()
+
+outbound = OutboundScheduler()
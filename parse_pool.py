@@ -0,0 +1,153 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import redis
+from bs4 import BeautifulSoup
+from redis_store import redis_client
+
+PARSER_WORKERS = int(os.getenv("PARSER_WORKERS", min(4, os.cpu_count() or 1)))
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+PARSE_METRICS_KEY = "parse_metrics"
+
+_executor = None
+
+# Metrik waktu parsing per situs disimpan di Redis (parse_metrics:<situs>, daftar situs di set parse_metrics)
+# agar bisa dibaca dashboard dan tetap terkumpul saat parsing berjalan di scrape worker terpisah
+RECORD_PARSE_SCRIPT = redis_client.register_script("""
+redis.call('SADD', KEYS[1], ARGV[1])
+redis.call('HINCRBY', KEYS[2], 'count', 1)
+redis.call('HINCRBYFLOAT', KEYS[2], 'total_ms', ARGV[2])
+redis.call('HSET', KEYS[2], 'last_ms', ARGV[2])
+if tonumber(ARGV[2]) > tonumber(redis.call('HGET', KEYS[2], 'max_ms') or '0') then
+    redis.call('HSET', KEYS[2], 'max_ms', ARGV[2])
+end
+""")
+
+# Fungsi ekstraksi di bawah dijalankan di worker process, jadi hanya menerima/mengembalikan data sederhana
+def extract_hide_my_ip_proxies(html):
+    soup = BeautifulSoup(html, "html.parser")
+    proxies = []
+    for row in soup.select("table tr")[1:]:  # Skip header
+        cols = row.find_all("td")
+        if len(cols) > 1:
+            ip = cols[0].text.strip()
+            port = cols[1].text.strip()
+            if ip and port and ":" not in ip:
+                proxies.append((ip, port))
+    return proxies
+
+def extract_free_proxy_list_proxies(html):
+    soup = BeautifulSoup(html, "html.parser")
+    table = soup.find("table")
+    if not table or not table.find("tbody"):
+        return None
+    proxies = []
+    for row in table.find("tbody").find_all("tr"):
+        cols = row.find_all("td")
+        if len(cols) > 3 and cols[3].text.strip() == "Indonesia":
+            proxies.append((cols[0].text.strip(), cols[1].text.strip()))
+    return proxies
+
+def extract_proxynova_proxies(html):
+    soup = BeautifulSoup(html, "html.parser")
+    table = soup.find("table", {"id": "tbl_proxy_list"})
+    if not table or not table.find("tbody"):
+        return None
+    proxies = []
+    for row in table.find("tbody").find_all("tr"):
+        cols = row.find_all("td")
+        if len(cols) >= 2:
+            ip = cols[0].text.strip()
+            port = cols[1].text.strip()
+            if ip and port:
+                proxies.append((ip, port))
+    return proxies
+
+def extract_sslproxies_proxies(html):
+    soup = BeautifulSoup(html, "html.parser")
+    table = soup.find("table", {"class": "table"})
+    if not table or not table.find("tbody"):
+        return None
+    proxies = []
+    for row in table.find("tbody").find_all("tr"):
+        cols = row.find_all("td")
+        if len(cols) > 3 and cols[3].text.strip() == "ID":
+            proxies.append((cols[0].text.strip(), cols[1].text.strip()))
+    return proxies
+
+def _timed(func, *args):
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+def get_parse_pool():
+    global _executor
+    if _executor is None and PARSER_WORKERS > 0:
+        _executor = ProcessPoolExecutor(max_workers=PARSER_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        logger.info(f"✅ Parser pool siap dengan {PARSER_WORKERS} worker")
+    return _executor
+
+# Worker yang mati (OOM, segfault di parser) membuat seluruh pool rusak permanen; pool itu dibuang agar
+# pemanggilan berikutnya membuat pool baru. Pengecekan identitas mencegah pool baru ikut dibuang
+def _discard_broken_pool(pool):
+    global _executor
+    if _executor is pool:
+        _executor = None
+        pool.shutdown(wait=False, cancel_futures=True)
+        logger.warning("⚠️ Worker parser mati, parser pool dibuat ulang")
+
+async def record_parse_time(site, elapsed):
+    elapsed_ms = elapsed * 1000
+    logger.debug(f"⏱️ {site}: Parsing selesai dalam {elapsed_ms:.1f} ms")
+    try:
+        await RECORD_PARSE_SCRIPT(keys=[PARSE_METRICS_KEY, f"{PARSE_METRICS_KEY}:{site}"], args=[site, round(elapsed_ms, 2)])
+    except redis.RedisError as e:
+        logger.debug(f"ℹ️ Metrik parsing {site} tidak tersimpan: {e}")
+
+async def parse_metrics_snapshot():
+    sites = sorted(await redis_client.smembers(PARSE_METRICS_KEY))
+    pipe = redis_client.pipeline()
+    for site in sites:
+        pipe.hmget(f"{PARSE_METRICS_KEY}:{site}", "count", "total_ms", "max_ms", "last_ms")
+    metrics = {}
+    for site, (count, total_ms, max_ms, last_ms) in zip(sites, await pipe.execute()):
+        count = int(count or 0)
+        metrics[site] = {
+            "count": count,
+            "avg_ms": round(float(total_ms or 0) / count, 2) if count else 0,
+            "max_ms": float(max_ms or 0),
+            "last_ms": float(last_ms or 0),
+        }
+    return metrics
+
+# Dicoba sekali lagi di pool baru jika pool rusak; jika halaman yang sama membuat worker mati lagi, hanya
+# parsing ini yang gagal. inline=True untuk parsing ringan yang lebih murah dijalankan langsung daripada lewat IPC
+async def run_parser(site, func, *args, inline=False):
+    for attempt in range(2):
+        pool = None if inline else get_parse_pool()
+        if pool is None:
+            result, elapsed = _timed(func, *args)
+            break
+        try:
+            result, elapsed = await asyncio.get_running_loop().run_in_executor(pool, _timed, func, *args)
+            break
+        except BrokenProcessPool:
+            _discard_broken_pool(pool)
+            if attempt:
+                raise
+    await record_parse_time(site, elapsed)
+    return result
+
+def shutdown_parse_pool():
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=False, cancel_futures=True)
+        _executor = None
+        logger.info("✅ Parser pool dihentikan")
@@ -0,0 +1,60 @@
+import re
+from bs4 import BeautifulSoup
+
+try:
+    from selectolax.lexbor import LexborHTMLParser
+except ImportError:
+    LexborHTMLParser = None
+
+try:
+    import lxml.html
+except ImportError:
+    lxml = None
+
+PRICE_PATTERN = r"Rp\s*\d+(?:[.,]\d+)*"
+PRICE_BYTES_RE = re.compile(PRICE_PATTERN.encode())
+
+# Mode "regex" tidak membangun DOM sama sekali, cukup scan byte mentah halaman
+def extract_prices_regex(data, selector=None):
+    return [match.decode("ascii", "ignore") for match in PRICE_BYTES_RE.findall(data)]
+
+def extract_prices_selectolax(data, selector):
+    tree = LexborHTMLParser(data)
+    prices = [node.text(strip=True) for node in tree.css(selector)]
+    return prices or extract_prices_regex(data)
+
+def _class_selector_to_xpath(selector):
+    classes = [cls for cls in selector.split(".") if cls]
+    conditions = " and ".join(f"contains(concat(' ', normalize-space(@class), ' '), ' {cls} ')" for cls in classes)
+    return f"//*[{conditions}]"
+
+def extract_prices_lxml(data, selector):
+    if not data.strip():
+        return []
+    tree = lxml.html.fromstring(data)
+    prices = [el.text_content().strip() for el in tree.xpath(_class_selector_to_xpath(selector))]
+    return prices or extract_prices_regex(data)
+
+def extract_prices_bs4(data, selector):
+    soup = BeautifulSoup(data, "html.parser")
+    prices = [el.get_text(strip=True) for el in soup.select(selector)]
+    return prices or re.findall(PRICE_PATTERN, soup.get_text())
+
+EXTRACTORS = {
+    "regex": extract_prices_regex,
+    "bs4": extract_prices_bs4,
+}
+if LexborHTMLParser is not None:
+    EXTRACTORS["selectolax"] = extract_prices_selectolax
+if lxml is not None:
+    EXTRACTORS["lxml"] = extract_prices_lxml
+
+def resolve_extractor(mode):
+    if mode == "auto":
+        for name in ("selectolax", "lxml", "bs4"):
+            if name in EXTRACTORS:
+                return name
+    return mode if mode in EXTRACTORS else "bs4"
+
+def extract_prices(data, selector, mode="auto"):
+    return EXTRACTORS[resolve_extractor(mode)](data, selector)
@@ -0,0 +1,74 @@
+import json
+import re
+import time
+from dataclasses import dataclass, field
+import msgpack
+
+PRICE_RECORD_VERSION = 1
+
+def format_rupiah(value):
+    return "{:,.0f}".format(value).replace(",", ".")
+
+def parse_rupiah(text):
+    digits = re.sub(r"[^\d]", "", str(text))
+    return int(digits) if digits else 0
+
+@dataclass
+class SitePrice:
+    min: int
+    max: int
+    avg: int
+    samples: int = 0
+
+@dataclass
+class PriceRecord:
+    min: int
+    max: int
+    avg: int
+    ts: float = field(default_factory=time.time)
+    sites: dict = field(default_factory=dict)
+
+    @property
+    def sources(self):
+        return list(self.sites)
+
+    def pack(self):
+        sites = [[name, site.min, site.max, site.avg, site.samples] for name, site in self.sites.items()]
+        return msgpack.packb([PRICE_RECORD_VERSION, self.min, self.max, self.avg, int(self.ts), sites])
+
+    @classmethod
+    def unpack(cls, data):
+        if isinstance(data, bytes):
+            try:
+                payload = msgpack.unpackb(data)
+            except (ValueError, msgpack.ExtraData):
+                payload = None
+            if isinstance(payload, list) and payload and payload[0] == PRICE_RECORD_VERSION:
+                _, min_price, max_price, avg_price, ts, sites = payload
+                return cls(min_price, max_price, avg_price, ts, {name: SitePrice(*values) for name, *values in sites})
+            data = data.decode("utf-8", "ignore")
+        return cls.from_display(data)
+
+    # Format lama: "RpX - RpY" dari scraper atau JSON {"min", "max", "avg"} dari dashboard, tanpa timestamp
+    @classmethod
+    def from_display(cls, value):
+        if isinstance(value, str):
+            try:
+                value = json.loads(value)
+            except ValueError:
+                pass
+        if isinstance(value, dict):
+            min_price, max_price = parse_rupiah(value.get("min", 0)), parse_rupiah(value.get("max", 0))
+            avg_price = parse_rupiah(value.get("avg", 0)) or round((min_price + max_price) / 2)
+        elif isinstance(value, str) and " - " in value:
+            min_text, max_text = value.split(" - ", 1)
+            min_price, max_price = parse_rupiah(min_text), parse_rupiah(max_text)
+            avg_price = round((min_price + max_price) / 2)
+        else:
+            return None
+        if not max_price:
+            return None
+        return cls(min_price, max_price, avg_price, ts=None)
+
+    def to_display(self):
+        return {"min": format_rupiah(self.min), "max": format_rupiah(self.max), "avg": format_rupiah(self.avg)}
@@ -1,17 +1,19 @@
 import aiohttp
-from bs4 import BeautifulSoup
-import redis
 import random
 import asyncio
 import re
 import os
 import logging
-from utils import normalize_price_query, save_price_history, find_price_in_history
-
-REDIS_HOST = os.getenv("REDIS_HOST", "redis.railway.internal")
-REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
-REDIS_PASSWORD = os.getenv("REDIS_PASSWORD")
-redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, password=REDIS_PASSWORD, db=0, decode_responses=True)
+from http_client import site_session, get_sticky_proxy, release_site_session
+from admission import admission, AdmissionRejected
+from parse_pool import run_parser
+from price_extractors import extract_prices, resolve_extractor
+from singleflight import single_flight
+from scrape_queue import run_scrape_job
+from site_health import get_site_health
+from proxy_pool import select_site_proxy, report_site_proxy
+from price_record import PriceRecord, SitePrice
+from utils import normalize_price_query, save_price_history, find_price_in_history, price_cache_state
 
 USER_AGENTS = [
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36",
@@ -36,20 +38,34 @@ def get_headers(site):
         "Connection": "keep-alive",
     }
 
+SITE_SCRAPE_DEADLINE = float(os.getenv("SITE_SCRAPE_DEADLINE", 30))
+PRICE_EARLY_MIN_SOURCES = int(os.getenv("PRICE_EARLY_MIN_SOURCES", 3))
+PRICE_EARLY_MAX_SPREAD = float(os.getenv("PRICE_EARLY_MAX_SPREAD", 0.25))
+# "inline": scraping berjalan di proses bot; "queue": dikirim ke antrean Redis Streams dan dikerjakan scrape_worker.py
+SCRAPE_MODE = os.getenv("SCRAPE_MODE", "inline")
+
+# Extractor per situs: (mode, selector). Halaman pencarian Tokopedia/Lazada/Shopee dirender via JS
+# sehingga selector hampir tidak pernah cocok, jadi langsung scan regex tanpa membangun DOM
+SITE_EXTRACTORS = {
+    "Tokopedia": ("regex", ".price"),
+    "Lazada": ("regex", ".price"),
+    "Blibli": ("auto", ".product__price"),
+    "Samsung": ("auto", ".price"),
+    "Shopee": ("regex", ".price"),
+}
+
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
-def get_valid_proxy(max_retries=3):
-    for attempt in range(max_retries):
-        proxy = redis_client.lpop("proxy_list")
-        if not proxy:
-            logger.warning("⚠️ Tidak ada proxy tersedia di Redis.")
-            return None
-        redis_client.rpush("proxy_list", proxy)
-        logger.info(f"ℹ️ Menggunakan proxy {proxy} pada percobaan {attempt + 1}.")
+# Proxy sticky yang masih berlaku dipakai ulang; jika tidak ada, pilih dari pool yang diperingkat untuk situs ini
+async def get_valid_proxy(site):
+    proxy = get_sticky_proxy(site)
+    if proxy:
         return proxy
-    logger.warning(f"⚠️ Tidak ada proxy valid setelah {max_retries} percobaan.")
-    return None
+    proxy = await select_site_proxy(site)
+    if proxy:
+        logger.info(f"ℹ️ {site}: Menggunakan proxy {proxy}.")
+    return proxy
 
 def calculate_iqr_range(prices):
     if not prices or len(prices) < 4:
@@ -82,7 +98,7 @@ def clean_and_validate_prices(raw_prices, site):
     
     if not cleaned_prices:
         logger.info(f"{site}: Tidak ada harga valid ditemukan")
-        return {"max": "0", "min": "0", "avg": "0"}
+        return None
     
     lower_bound, upper_bound = calculate_iqr_range(cleaned_prices)
     if lower_bound is None:
@@ -94,7 +110,7 @@ def clean_and_validate_prices(raw_prices, site):
     
     if not valid_prices:
         logger.info(f"{site}: Tidak ada harga rasional ditemukan")
-        return {"max": "0", "min": "0", "avg": "0"}
+        return None
     
     sorted_prices = sorted(valid_prices)
     min_price = sorted_prices[0]
@@ -106,175 +122,204 @@ def clean_and_validate_prices(raw_prices, site):
         min_price = round(avg_price * 0.5)
         logger.info(f"{site}: Harga min disesuaikan ke {min_price:,} (50% dari avg)")
     
-    result = {
-        "max": "{:,.0f}".format(max_price).replace(",", "."),
-        "min": "{:,.0f}".format(min_price).replace(",", "."),
-        "avg": "{:,.0f}".format(avg_price).replace(",", ".")
-    }
+    result = SitePrice(min_price, max_price, avg_price, len(valid_prices))
     logger.info(f"{site}: Harga setelah validasi: {result}")
     return result
 
+# Mode regex hanya memindai byte mentah dalam hitungan milidetik, jadi dijalankan langsung di event loop; mengirim
+# halaman berukuran MB ke worker process lebih mahal daripada scan-nya. Hanya mode DOM yang masuk parser pool
+async def parse_site_prices(site, data):
+    mode, selector = SITE_EXTRACTORS[site]
+    mode = resolve_extractor(mode)
+    return await run_parser(site, extract_prices, data, selector, mode, inline=mode == "regex")
+
+# Timeout per request diambil dari p95 latensi situs, dan setiap hasil dicatat ke health tracker.
+# Hasil request lewat proxy hanya mengubah skor proxy untuk situs ini, bukan skor globalnya. Kegagalan dihitung
+# untuk situs hanya jika situs yang menolak (status HTTP error) atau koneksinya langsung; error koneksi/timeout
+# lewat proxy adalah kesalahan proxy dan cukup dicatat ke skor proxy tersebut
+async def fetch_site_page(site, url, proxy=None):
+    health = get_site_health(site)
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    try:
+        async with site_session(site, proxy) as session, session.get(
+            url, headers=get_headers(site.lower()), timeout=aiohttp.ClientTimeout(total=health.timeout())
+        ) as response:
+            redirected_url = str(response.url)
+            if redirected_url != url:
+                logger.info(f"{site}: Redirected ke: {redirected_url}")
+            response.raise_for_status()
+            data = await response.read()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        # ClientHttpProxyError turunan ClientResponseError, tapi statusnya berasal dari proxy
+        site_failed = not proxy or (
+            isinstance(e, aiohttp.ClientResponseError) and not isinstance(e, aiohttp.ClientHttpProxyError)
+        )
+        if site_failed:
+            health.record(False)
+        else:
+            health.abandon_probe()
+        if proxy:
+            # Sesi sticky dilepas agar percobaan berikutnya memilih proxy lain
+            await report_site_proxy(site, proxy, False)
+            await release_site_session(site, proxy)
+        raise
+    except BaseException:
+        # Termasuk CancelledError dari early-exit konsensus: hasil tidak diketahui, jadi probe cukup dilepas
+        health.abandon_probe()
+        raise
+    latency = loop.time() - started
+    health.record(True, latency)
+    if proxy:
+        await report_site_proxy(site, proxy, True, latency)
+    return data
+
 async def scrape_tokopedia_price(query):
     search_url = f"https://www.tokopedia.com/search?st=product&q={query.replace(' ', '+')}"
     logger.info(f"Tokopedia: Memulai scraping - URL awal: {search_url}")
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.get(search_url, headers=get_headers("tokopedia"), timeout=aiohttp.ClientTimeout(total=15)) as response:
-                redirected_url = str(response.url)
-                if redirected_url != search_url:
-                    logger.info(f"Tokopedia: Redirected ke: {redirected_url}")
-                text = await response.text()
-                soup = BeautifulSoup(text, "html.parser")
-                raw_prices = soup.select(".price") or re.findall(r"Rp\s*\d+(?:[.,]\d+)*", soup.get_text())
-                logger.info(f"Tokopedia: Harga mentah ditemukan: {[p.get_text(strip=True) if hasattr(p, 'get_text') else p for p in raw_prices]}")
-                return clean_and_validate_prices(raw_prices, "Tokopedia")
-        except Exception as e:
-            logger.error(f"Tokopedia: Gagal scraping: {e}")
-            return {"max": "0", "min": "0", "avg": "0"}
+    try:
+        data = await fetch_site_page("Tokopedia", search_url)
+        raw_prices = await parse_site_prices("Tokopedia", data)
+        logger.info(f"Tokopedia: Harga mentah ditemukan: {raw_prices}")
+        return clean_and_validate_prices(raw_prices, "Tokopedia")
+    except Exception as e:
+        logger.error(f"Tokopedia: Gagal scraping: {e}")
+        return None
 
 async def scrape_lazada_price(query, retries=3):
     search_url = f"https://www.lazada.co.id/catalog/?q={query.replace(' ', '+')}"
     logger.info(f"Lazada: Memulai scraping - URL awal: {search_url}")
     for attempt in range(retries):
-        proxy = get_valid_proxy()
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.get(
-                    search_url,
-                    headers=get_headers("lazada"),
-                    proxy=f"http://{proxy}" if proxy else None,
-                    timeout=aiohttp.ClientTimeout(total=15)
-                ) as response:
-                    redirected_url = str(response.url)
-                    if redirected_url != search_url:
-                        logger.info(f"Lazada: Redirected ke: {redirected_url}")
-                    text = await response.text()
-                    soup = BeautifulSoup(text, "html.parser")
-                    raw_prices = soup.select(".price") or re.findall(r"Rp\s*\d+(?:[.,]\d+)*", soup.get_text())
-                    logger.info(f"Lazada: Harga mentah ditemukan: {[p.get_text(strip=True) if hasattr(p, 'get_text') else p for p in raw_prices]}")
-                    return clean_and_validate_prices(raw_prices, "Lazada")
-            except Exception as e:
-                logger.error(f"Lazada: Gagal scraping{' dengan proxy ' + proxy if proxy else ''} pada percobaan {attempt + 1}: {e}")
-                if proxy:
-                    logger.info(f"🗑️ Proxy {proxy} gagal, dihapus dari Redis.")
-                    redis_client.lrem("proxy_list", 0, proxy)
+        if attempt and not get_site_health("Lazada").can_retry():
+            logger.warning(f"Lazada: Budget retry habis, berhenti setelah {attempt} percobaan.")
+            return None
+        proxy = await get_valid_proxy("Lazada")
+        try:
+            data = await fetch_site_page("Lazada", search_url, proxy)
+            raw_prices = await parse_site_prices("Lazada", data)
+            logger.info(f"Lazada: Harga mentah ditemukan: {raw_prices}")
+            return clean_and_validate_prices(raw_prices, "Lazada")
+        except Exception as e:
+            logger.error(f"Lazada: Gagal scraping{' dengan proxy ' + proxy if proxy else ''} pada percobaan {attempt + 1}: {e}")
     logger.error(f"Lazada: Gagal setelah {retries} percobaan.")
-    return {"max": "0", "min": "0", "avg": "0"}
+    return None
 
 async def scrape_blibli_price(query, retries=3):
     search_url = f"https://www.blibli.com/cari/{query.replace(' ', '%20')}"
     logger.info(f"Blibli: Memulai scraping - URL awal: {search_url}")
     for attempt in range(retries):
-        proxy = get_valid_proxy()
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.get(
-                    search_url,
-                    headers=get_headers("blibli"),
-                    proxy=f"http://{proxy}" if proxy else None,
-                    timeout=aiohttp.ClientTimeout(total=15)
-                ) as response:
-                    redirected_url = str(response.url)
-                    if redirected_url != search_url:
-                        logger.info(f"Blibli: Redirected ke: {redirected_url}")
-                    text = await response.text()
-                    soup = BeautifulSoup(text, "html.parser")
-                    raw_prices = soup.select(".product__price") or re.findall(r"Rp\s*\d+(?:[.,]\d+)*", soup.get_text())
-                    logger.info(f"Blibli: Harga mentah ditemukan: {[p.get_text(strip=True) if hasattr(p, 'get_text') else p for p in raw_prices]}")
-                    return clean_and_validate_prices(raw_prices, "Blibli")
-            except Exception as e:
-                logger.error(f"Blibli: Gagal scraping{' dengan proxy ' + proxy if proxy else ''} pada percobaan {attempt + 1}: {e}")
-                if proxy:
-                    logger.info(f"🗑️ Proxy {proxy} gagal, dihapus dari Redis.")
-                    redis_client.lrem("proxy_list", 0, proxy)
+        if attempt and not get_site_health("Blibli").can_retry():
+            logger.warning(f"Blibli: Budget retry habis, berhenti setelah {attempt} percobaan.")
+            return None
+        proxy = await get_valid_proxy("Blibli")
+        try:
+            data = await fetch_site_page("Blibli", search_url, proxy)
+            raw_prices = await parse_site_prices("Blibli", data)
+            logger.info(f"Blibli: Harga mentah ditemukan: {raw_prices}")
+            return clean_and_validate_prices(raw_prices, "Blibli")
+        except Exception as e:
+            logger.error(f"Blibli: Gagal scraping{' dengan proxy ' + proxy if proxy else ''} pada percobaan {attempt + 1}: {e}")
     logger.error(f"Blibli: Gagal setelah {retries} percobaan.")
-    return {"max": "0", "min": "0", "avg": "0"}
+    return None
 
 async def scrape_samsung_price(query):
     # Langsung ke halaman produk S23 Ultra
     search_url = "https://www.samsung.com/id/smartphones/galaxy-s23-ultra/buy/"
     logger.info(f"Samsung: Memulai scraping - URL awal: {search_url}")
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.get(search_url, headers=get_headers("samsung"), timeout=aiohttp.ClientTimeout(total=15)) as response:
-                text = await response.text()
-                soup = BeautifulSoup(text, "html.parser")
-                raw_prices = soup.select(".price") or re.findall(r"Rp\s*\d+(?:[.,]\d+)*", soup.get_text())
-                logger.info(f"Samsung: Harga mentah ditemukan: {[p.get_text(strip=True) if hasattr(p, 'get_text') else p for p in raw_prices]}")
-                return clean_and_validate_prices(raw_prices, "Samsung")
-        except Exception as e:
-            logger.error(f"Samsung: Gagal scraping: {e}")
-            return {"max": "0", "min": "0", "avg": "0"}
+    try:
+        data = await fetch_site_page("Samsung", search_url)
+        raw_prices = await parse_site_prices("Samsung", data)
+        logger.info(f"Samsung: Harga mentah ditemukan: {raw_prices}")
+        return clean_and_validate_prices(raw_prices, "Samsung")
+    except Exception as e:
+        logger.error(f"Samsung: Gagal scraping: {e}")
+        return None
 
 async def scrape_shopee_price(query, retries=3):
     search_url = f"https://shopee.co.id/search?keyword={query.replace(' ', '%20')}"
     logger.info(f"Shopee: Memulai scraping - URL awal: {search_url}")
     for attempt in range(retries):
-        proxy = get_valid_proxy()
-        async with aiohttp.ClientSession() as session:
-            try:
-                async with session.get(
-                    search_url,
-                    headers=get_headers("shopee"),
-                    proxy=f"http://{proxy}" if proxy else None,
-                    timeout=aiohttp.ClientTimeout(total=15)
-                ) as response:
-                    redirected_url = str(response.url)
-                    if redirected_url != search_url:
-                        logger.info(f"Shopee: Redirected ke: {redirected_url}")
-                    text = await response.text()
-                    soup = BeautifulSoup(text, "html.parser")
-                    raw_prices = soup.select(".price") or re.findall(r"Rp\s*\d+(?:[.,]\d+)*", soup.get_text())
-                    logger.info(f"Shopee: Harga mentah ditemukan: {[p.get_text(strip=True) if hasattr(p, 'get_text') else p for p in raw_prices]}")
-                    return clean_and_validate_prices(raw_prices, "Shopee")
-            except Exception as e:
-                logger.error(f"Shopee: Gagal scraping{' dengan proxy ' + proxy if proxy else ''} pada percobaan {attempt + 1}: {e}")
-                if proxy:
-                    logger.info(f"🗑️ Proxy {proxy} gagal, dihapus dari Redis.")
-                    redis_client.lrem("proxy_list", 0, proxy)
+        if attempt and not get_site_health("Shopee").can_retry():
+            logger.warning(f"Shopee: Budget retry habis, berhenti setelah {attempt} percobaan.")
+            return None
+        proxy = await get_valid_proxy("Shopee")
+        try:
+            data = await fetch_site_page("Shopee", search_url, proxy)
+            raw_prices = await parse_site_prices("Shopee", data)
+            logger.info(f"Shopee: Harga mentah ditemukan: {raw_prices}")
+            return clean_and_validate_prices(raw_prices, "Shopee")
+        except Exception as e:
+            logger.error(f"Shopee: Gagal scraping{' dengan proxy ' + proxy if proxy else ''} pada percobaan {attempt + 1}: {e}")
     logger.error(f"Shopee: Gagal setelah {retries} percobaan.")
-    return {"max": "0", "min": "0", "avg": "0"}
+    return None
 
 def round_to_nearest_hundred_thousand(value):
     return round(value / 100000) * 100000
 
-async def scrape_price(query):
+_background_refreshes = set()
+
+# Refresh ikut batas scraping bersamaan global; saat semua slot terpakai refresh dilewati dan cache basi tetap dipakai
+def refresh_price_in_background(query):
+    if not admission.has_capacity():
+        logger.info(f"ℹ️ Cache harga '{query}' sudah basi, refresh dilewati karena slot scraping penuh")
+        return
+    logger.info(f"♻️ Cache harga '{query}' sudah basi, memperbarui di background")
+
+    async def scrape():
+        async with admission.background_slot():
+            return await run_scrape(query)
+
+    async def refresh():
+        try:
+            await single_flight(query, scrape, encode=encode_price_record, decode=decode_price_record)
+        except AdmissionRejected as e:
+            logger.info(f"ℹ️ Refresh cache harga '{query}' dibatalkan admission ({e.reason})")
+
+    task = asyncio.create_task(refresh())
+    _background_refreshes.add(task)
+    task.add_done_callback(_background_refreshes.discard)
+
+async def scrape_price(query, on_progress=None, admission_ticket=None):
     logger.info(f"🔍 Mencari harga untuk: {query}")
-    cached_answer = find_price_in_history(query)
-    if cached_answer:
-        min_max = cached_answer.split(" - ")
-        avg = round((int(min_max[0].replace("Rp", "").replace(".", "")) + int(min_max[1].replace("Rp", "").replace(".", ""))) / 2)
-        result = {
-            "max": "{:,.0f}".format(int(min_max[1].replace("Rp", "").replace(".", ""))).replace(",", "."),
-            "min": "{:,.0f}".format(int(min_max[0].replace("Rp", "").replace(".", ""))).replace(",", "."),
-            "avg": "{:,.0f}".format(avg).replace(",", ".")
-        }
-        logger.info(f"🔄 Menggunakan cache: {result}")
-        return result
-
-    tasks = [
-        asyncio.wait_for(scrape_tokopedia_price(query), timeout=15),
-        asyncio.wait_for(scrape_lazada_price(query), timeout=15),
-        asyncio.wait_for(scrape_blibli_price(query), timeout=15),
-        asyncio.wait_for(scrape_samsung_price(query), timeout=15),
-        asyncio.wait_for(scrape_shopee_price(query), timeout=15),
-    ]
-    results = await asyncio.gather(*tasks, return_exceptions=True)
-    
+    cached = await find_price_in_history(query)
+    cache_state = price_cache_state(cached[1].ts) if cached else "expired"
+    if cache_state != "expired":
+        cached_key, record = cached
+        logger.info(f"🔄 Menggunakan cache ({cache_state}): {record}")
+        if cache_state == "stale":
+            refresh_price_in_background(cached_key)
+        return record
+
+    # Admission hanya dibebankan saat cache tidak bisa menjawab, jadi hit cache tidak ikut dibatasi
+    if admission_ticket is not None:
+        admission_ticket.charge()
+
+    # Slot konkurensi hanya diambil leader yang benar-benar scraping; pemanggil yang bergabung tidak ikut antre
+    async def scrape():
+        if admission_ticket is None:
+            return await run_scrape(query, on_progress)
+        async with admission_ticket.slot():
+            return await run_scrape(query, on_progress)
+
+    # Query identik yang datang bersamaan (termasuk dari replika lain) berbagi satu scraping
+    return await single_flight(query, scrape, encode=encode_price_record, decode=decode_price_record)
+
+async def run_scrape(query, on_progress=None):
+    if SCRAPE_MODE == "queue":
+        return await run_scrape_job(query, on_progress)
+    return await scrape_all_sites(query, on_progress)
+
+def encode_price_record(record):
+    return record.pack() if record else b""
+
+def decode_price_record(data):
+    return PriceRecord.unpack(data) if data else None
+
+def build_price_record(sites, label="Hasil akhir"):
     all_valid_prices = []
-    for i, result in enumerate(results):
-        if not isinstance(result, Exception) and result["avg"] != "0":
-            site = ["Tokopedia", "Lazada", "Blibli", "Samsung", "Shopee"][i]
-            prices = [
-                int(result["min"].replace(".", "")),
-                int(result["max"].replace(".", "")),
-                int(result["avg"].replace(".", ""))
-            ]
-            all_valid_prices.extend(prices)
-            logger.info(f"{site}: Menambahkan harga valid ke hasil akhir: {prices}")
-    
+    for site in sites.values():
+        all_valid_prices.extend([site.min, site.max, site.avg])
     if not all_valid_prices:
-        logger.info(f"❌ Tidak ada hasil valid untuk {query} dari semua situs")
         return None
     
     min_price = round_to_nearest_hundred_thousand(min(all_valid_prices))
@@ -284,13 +329,63 @@ async def scrape_price(query):
     # Validasi min tidak terlalu jauh dari avg
     if min_price < avg_price * 0.5:
         min_price = round(avg_price * 0.5)
-        logger.info(f"Hasil akhir: Harga min disesuaikan ke {min_price:,} (50% dari avg)")
+        logger.info(f"{label}: Harga min disesuaikan ke {min_price:,} (50% dari avg)")
     
-    result = {
-        "max": "{:,.0f}".format(max_price).replace(",", "."),
-        "min": "{:,.0f}".format(min_price).replace(",", "."),
-        "avg": "{:,.0f}".format(avg_price).replace(",", ".")
-    }
-    save_price_history(query, f"Rp{result['min']} - Rp{result['max']}")
+    return PriceRecord(min_price, max_price, avg_price, sites=dict(sites))
+
+# Hasil dianggap cukup yakin jika sumber valid sudah cukup banyak dan rata-ratanya saling berdekatan
+def is_confident(sites):
+    if len(sites) < PRICE_EARLY_MIN_SOURCES:
+        return False
+    averages = [site.avg for site in sites.values()]
+    return max(averages) <= min(averages) * (1 + PRICE_EARLY_MAX_SPREAD)
+
+async def _scrape_site(site, scraper, query):
+    try:
+        return site, await asyncio.wait_for(scraper(query), timeout=SITE_SCRAPE_DEADLINE)
+    except Exception as e:
+        logger.error(f"{site}: Scraping dihentikan: {e!r}")
+        return site, None
+
+async def scrape_all_sites(query, on_progress=None):
+    active_sites = {site: scraper for site, scraper in SITE_SCRAPERS.items() if get_site_health(site).allow_request()}
+    skipped_sites = set(SITE_SCRAPERS) - set(active_sites)
+    if skipped_sites:
+        logger.info(f"🔌 Melewati situs dengan circuit terbuka: {sorted(skipped_sites)}")
+    tasks = [asyncio.create_task(_scrape_site(site, scraper, query)) for site, scraper in active_sites.items()]
+    sites = {}
+    done = 0
+    try:
+        for next_result in asyncio.as_completed(tasks):
+            site, result = await next_result
+            done += 1
+            if isinstance(result, SitePrice):
+                sites[site] = result
+                logger.info(f"{site}: Menambahkan harga valid ke hasil akhir: {[result.min, result.max, result.avg]}")
+            if on_progress:
+                try:
+                    await on_progress(done, len(tasks), build_price_record(sites, label="Sementara"))
+                except Exception as e:
+                    logger.warning(f"⚠️ Gagal mengirim progres harga: {e}")
+            if done < len(tasks) and is_confident(sites):
+                logger.info(f"⚡ {len(sites)}/{len(tasks)} sumber sudah konsisten, menghentikan sisa scraping untuk {query}")
+                break
+    finally:
+        for task in tasks:
+            task.cancel()
+    
+    result = build_price_record(sites)
+    if result is None:
+        logger.info(f"❌ Tidak ada hasil valid untuk {query} dari semua situs")
+        return None
+    await save_price_history(query, result)
     logger.info(f"✅ Hasil akhir untuk {query}: {result}")
-    return result
\ No newline at end of file
+    return result
+
+SITE_SCRAPERS = {
+    "Tokopedia": scrape_tokopedia_price,
+    "Lazada": scrape_lazada_price,
+    "Blibli": scrape_blibli_price,
+    "Samsung": scrape_samsung_price,
+    "Shopee": scrape_shopee_price,
+}
@@ -0,0 +1,241 @@
+import logging
+import os
+import random
+import time
+from redis_store import redis_client
+from dashboard_events import queue_dashboard_event, publish_dashboard_event
+
+PROXY_POOL_KEY = "proxy_pool"
+PROXY_SEEN_KEY = "proxy_seen"
+PROXY_REVALIDATE_KEY = "proxy_revalidate_at"
+# Daftar key proxy_pool:<situs> yang pernah dibuat, agar proxy yang dibuang dari pool global ikut dihapus di sana
+PROXY_SITE_POOLS_KEY = "proxy_site_pools"
+PROXY_INITIAL_SCORE = float(os.getenv("PROXY_INITIAL_SCORE", 50))
+PROXY_SCORE_FLOOR = float(os.getenv("PROXY_SCORE_FLOOR", 15))
+PROXY_SCORE_DECAY = float(os.getenv("PROXY_SCORE_DECAY", 0.7))
+PROXY_LATENCY_CEILING = float(os.getenv("PROXY_LATENCY_CEILING", 15))
+PROXY_SELECTION_CANDIDATES = int(os.getenv("PROXY_SELECTION_CANDIDATES", 20))
+PROXY_SITE_WEIGHT = float(os.getenv("PROXY_SITE_WEIGHT", 0.7))
+PROXY_SEEN_TTL = int(os.getenv("PROXY_SEEN_TTL", 24 * 3600))
+PROXY_REVALIDATE_MIN = float(os.getenv("PROXY_REVALIDATE_MIN", 5 * 60))
+PROXY_REVALIDATE_MAX = float(os.getenv("PROXY_REVALIDATE_MAX", 6 * 3600))
+PROXY_REVALIDATE_MATURITY = float(os.getenv("PROXY_REVALIDATE_MATURITY", 24 * 3600))
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+# Skor adalah rata-rata bergerak eksponensial dari reward (0-100). Proxy di bawah floor langsung dibuang,
+# termasuk dari semua pool situs (KEYS[3..]). Dijalankan sebagai Lua agar baca-ubah-tulis skor atomik walau
+# banyak scraper melapor bersamaan.
+REPORT_PROXY_SCRIPT = redis_client.register_script("""
+local score = redis.call('ZSCORE', KEYS[1], ARGV[1])
+if not score then
+    for i = 2, #KEYS do
+        redis.call('ZREM', KEYS[i], ARGV[1])
+    end
+    return false
+end
+local new_score = tonumber(score) * tonumber(ARGV[3]) + tonumber(ARGV[2]) * (1 - tonumber(ARGV[3]))
+if new_score < tonumber(ARGV[4]) then
+    for i = 1, #KEYS do
+        redis.call('ZREM', KEYS[i], ARGV[1])
+    end
+    return '-1'
+end
+redis.call('ZADD', KEYS[1], 'XX', new_score, ARGV[1])
+return tostring(new_score)
+""")
+
+# Skor per situs di proxy_pool:<situs> memakai EWMA yang sama, dimulai dari skor global proxy. Proxy yang
+# diblokir satu situs hanya turun di situs itu (tidak dihapus) agar tidak dipilih ulang untuk situs tersebut.
+REPORT_SITE_PROXY_SCRIPT = redis_client.register_script("""
+local score = redis.call('ZSCORE', KEYS[2], ARGV[1]) or redis.call('ZSCORE', KEYS[1], ARGV[1])
+if not score then
+    redis.call('ZREM', KEYS[2], ARGV[1])
+    return false
+end
+local new_score = tonumber(score) * tonumber(ARGV[3]) + tonumber(ARGV[2]) * (1 - tonumber(ARGV[3]))
+redis.call('ZADD', KEYS[2], new_score, ARGV[1])
+redis.call('SADD', KEYS[3], KEYS[2])
+return tostring(new_score)
+""")
+
+# Kandidat diambil dari peringkat teratas pool situs dan pool global, lalu digabung:
+# skor = w * skor_situs + (1 - w) * skor_global. Proxy yang sudah tidak ada di pool global dibersihkan dari
+# pool situs, dan proxy dengan skor situs di bawah floor dilewati.
+SELECT_SITE_PROXY_SCRIPT = redis_client.register_script("""
+local limit = tonumber(ARGV[1]) - 1
+local weight = tonumber(ARGV[2])
+local floor = tonumber(ARGV[3])
+local candidates = {}
+local order = {}
+for _, key in ipairs(KEYS) do
+    for _, proxy in ipairs(redis.call('ZREVRANGE', key, 0, limit)) do
+        if not candidates[proxy] then
+            candidates[proxy] = true
+            table.insert(order, proxy)
+        end
+    end
+end
+local result = {}
+for _, proxy in ipairs(order) do
+    local global_score = redis.call('ZSCORE', KEYS[1], proxy)
+    if not global_score then
+        redis.call('ZREM', KEYS[2], proxy)
+    else
+        local site_score = redis.call('ZSCORE', KEYS[2], proxy) or global_score
+        if tonumber(site_score) >= floor then
+            table.insert(result, proxy)
+            table.insert(result, tostring(weight * tonumber(site_score) + (1 - weight) * tonumber(global_score)))
+        end
+    end
+end
+return result
+""")
+
+def site_pool_key(site):
+    return f"{PROXY_POOL_KEY}:{site.lower()}"
+
+def proxy_reward(ok, latency=None):
+    if not ok:
+        return 0
+    if latency is None:
+        return 100
+    # Proxy cepat mendapat reward penuh, proxy lambat mendekati 10
+    return 100 * max(0.1, 1 - latency / PROXY_LATENCY_CEILING)
+
+# Hasil revalidasi dilaporkan dalam satu pipeline: {proxy: latensi, atau None jika gagal} -> {proxy: skor baru}
+async def report_proxies(outcomes):
+    site_pools = sorted(await redis_client.smembers(PROXY_SITE_POOLS_KEY))
+    pipe = redis_client.pipeline()
+    for proxy, latency in outcomes.items():
+        await REPORT_PROXY_SCRIPT(
+            keys=[PROXY_POOL_KEY, PROXY_REVALIDATE_KEY, *site_pools],
+            args=[proxy, proxy_reward(latency is not None, latency), PROXY_SCORE_DECAY, PROXY_SCORE_FLOOR],
+            client=pipe,
+        )
+    scores = {}
+    results = await pipe.execute()
+    for proxy, result in zip(outcomes, results):
+        score = float(result) if result is not None else -1
+        scores[proxy] = score if score >= 0 else None
+    # Hanya hasil '-1' yang berarti proxy baru saja dibuang; None berarti memang sudah tidak ada di pool
+    await publish_dashboard_event("proxy", "remove", [proxy for proxy, result in zip(outcomes, results) if result == "-1"])
+    return scores
+
+async def report_site_proxy(site, proxy, ok, latency=None):
+    result = await REPORT_SITE_PROXY_SCRIPT(
+        keys=[PROXY_POOL_KEY, site_pool_key(site), PROXY_SITE_POOLS_KEY], args=[proxy, proxy_reward(ok, latency), PROXY_SCORE_DECAY]
+    )
+    if result is None:
+        return None
+    score = float(result)
+    if score < PROXY_SCORE_FLOOR:
+        logger.info(f"🚫 Proxy {proxy} di bawah skor minimum untuk {site}, tidak dipakai lagi untuk situs ini.")
+    return score
+
+async def select_site_proxy(site):
+    result = await SELECT_SITE_PROXY_SCRIPT(
+        keys=[PROXY_POOL_KEY, site_pool_key(site)], args=[PROXY_SELECTION_CANDIDATES, PROXY_SITE_WEIGHT, PROXY_SCORE_FLOOR]
+    )
+    if not result:
+        logger.warning(f"⚠️ Tidak ada proxy tersedia untuk {site} di Redis.")
+        return None
+    proxies, scores = result[0::2], [float(score) for score in result[1::2]]
+    return random.choices(proxies, weights=[max(score, 1) ** 2 for score in scores])[0]
+
+async def add_proxies(proxies, score=PROXY_INITIAL_SCORE):
+    if not proxies:
+        return 0
+    mapping = proxies if isinstance(proxies, dict) else {proxy: score for proxy in proxies}
+    due_at = time.time() + PROXY_REVALIDATE_MIN
+    proxies = list(mapping)
+    pipe = redis_client.pipeline()
+    # Satu ZADD NX per proxy agar terlihat mana yang benar-benar baru; hanya itu yang dikirim ke dashboard
+    for proxy in proxies:
+        pipe.zadd(PROXY_POOL_KEY, {proxy: mapping[proxy]}, nx=True)
+    pipe.zadd(PROXY_REVALIDATE_KEY, {proxy: due_at for proxy in proxies}, nx=True)
+    results = await pipe.execute()
+    added = [proxy for proxy, result in zip(proxies, results) if result]
+    await publish_dashboard_event("proxy", "add", added)
+    return len(added)
+
+def initial_proxy_score(latency):
+    return (PROXY_INITIAL_SCORE + proxy_reward(True, latency)) / 2
+
+async def remove_proxy(proxy):
+    site_pools = await redis_client.smembers(PROXY_SITE_POOLS_KEY)
+    pipe = redis_client.pipeline()
+    pipe.zrem(PROXY_POOL_KEY, proxy)
+    pipe.zrem(PROXY_REVALIDATE_KEY, proxy)
+    for key in site_pools:
+        pipe.zrem(key, proxy)
+    queue_dashboard_event(pipe, "proxy", "remove", [proxy])
+    return (await pipe.execute())[0]
+
+async def count_proxies():
+    return await redis_client.zcard(PROXY_POOL_KEY)
+
+async def list_proxies():
+    return await redis_client.zrevrange(PROXY_POOL_KEY, 0, -1)
+
+# proxy_seen menyimpan waktu pertama kali proxy ditemukan. Kandidat yang sudah pernah dilihat tidak dites ulang
+# dari sumber; proxy yang lolos dirawat lewat jadwal revalidasi, yang gagal baru dicoba lagi setelah PROXY_SEEN_TTL
+async def filter_unseen_proxies(proxies, now=None):
+    proxies = list(proxies)
+    if not proxies:
+        return []
+    seen = await redis_client.zmscore(PROXY_SEEN_KEY, proxies)
+    unseen = [proxy for proxy, first_seen in zip(proxies, seen) if first_seen is None]
+    if unseen:
+        await redis_client.zadd(PROXY_SEEN_KEY, {proxy: now or time.time() for proxy in unseen}, nx=True)
+    return unseen
+
+async def prune_seen_proxies(now=None):
+    expired = await redis_client.zrangebyscore(PROXY_SEEN_KEY, "-inf", (now or time.time()) - PROXY_SEEN_TTL)
+    if not expired:
+        return 0
+    # Proxy yang masih ada di pool tetap disimpan karena umurnya dipakai untuk jadwal revalidasi
+    in_pool = await redis_client.zmscore(PROXY_POOL_KEY, expired)
+    stale = [proxy for proxy, score in zip(expired, in_pool) if score is None]
+    return await redis_client.zrem(PROXY_SEEN_KEY, *stale) if stale else 0
+
+# Proxy yang sudah lama bertahan dan skornya tinggi jarang berubah, jadi dicek lebih jarang;
+# proxy baru atau yang skornya mepet floor dicek sesering PROXY_REVALIDATE_MIN
+def revalidation_interval(score, age):
+    health = max(0.0, (score - PROXY_SCORE_FLOOR) / (100 - PROXY_SCORE_FLOOR))
+    maturity = min(1.0, max(0.0, age) / PROXY_REVALIDATE_MATURITY)
+    return PROXY_REVALIDATE_MIN + (PROXY_REVALIDATE_MAX - PROXY_REVALIDATE_MIN) * health * maturity
+
+async def due_proxies(limit, now=None):
+    return await redis_client.zrangebyscore(PROXY_REVALIDATE_KEY, "-inf", now or time.time(), start=0, num=limit)
+
+async def schedule_revalidation(results, now=None):
+    # results: {proxy: skor baru}; proxy yang sudah dibuang dari pool (skor None) sudah dihapus dari jadwal oleh Lua
+    now = now or time.time()
+    alive = {proxy: score for proxy, score in results.items() if score is not None}
+    if not alive:
+        return
+    first_seen = await redis_client.zmscore(PROXY_SEEN_KEY, list(alive))
+    schedule = {
+        proxy: now + revalidation_interval(score, now - (seen or now))
+        for (proxy, score), seen in zip(alive.items(), first_seen)
+    }
+    await redis_client.zadd(PROXY_REVALIDATE_KEY, schedule, xx=True)
+
+async def migrate_proxy_list():
+    legacy = await redis_client.lrange("proxy_list", 0, -1)
+    if legacy:
+        added = await add_proxies(legacy)
+        await redis_client.delete("proxy_list")
+        logger.info(f"✅ Memindahkan {added} proxy dari proxy_list ke {PROXY_POOL_KEY}")
+    # Proxy di pool yang belum punya jadwal revalidasi (dibuat sebelum ada penjadwal) dicek secepatnya
+    proxies = await list_proxies()
+    if proxies:
+        now = time.time()
+        pipe = redis_client.pipeline()
+        pipe.zadd(PROXY_SEEN_KEY, {proxy: now for proxy in proxies}, nx=True)
+        pipe.zadd(PROXY_REVALIDATE_KEY, {proxy: now for proxy in proxies}, nx=True)
+        scheduled = (await pipe.execute())[1]
+        if scheduled:
+            logger.info(f"✅ Menjadwalkan revalidasi untuk {scheduled} proxy lama")
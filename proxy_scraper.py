@@ -1,15 +1,25 @@
 import aiohttp
-from bs4 import BeautifulSoup
 import redis
 import random
 import logging
 import asyncio
+import hashlib
+import json
 import os
+import time
+from http_client import get_session, get_validation_session, PROXY_VALIDATION_CONCURRENCY
+from proxy_pool import (
+    add_proxies, count_proxies, initial_proxy_score, report_proxies,
+    filter_unseen_proxies, prune_seen_proxies, due_proxies, schedule_revalidation,
+)
+from redis_store import redis_client, check_redis_connection
+from parse_pool import run_parser, extract_hide_my_ip_proxies, extract_free_proxy_list_proxies, extract_proxynova_proxies, extract_sslproxies_proxies
 
-REDIS_HOST = os.getenv("REDIS_HOST", "redis.railway.internal")
-REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
-REDIS_PASSWORD = os.getenv("REDIS_PASSWORD")
-redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, password=REDIS_PASSWORD, db=0, decode_responses=True)
+PROXY_VALIDATION_TIMEOUT = float(os.getenv("PROXY_VALIDATION_TIMEOUT", 3))
+PROXY_VALIDATION_BATCH_SIZE = int(os.getenv("PROXY_VALIDATION_BATCH_SIZE", 50))
+PROXY_REVALIDATE_BATCH = int(os.getenv("PROXY_REVALIDATE_BATCH", 200))
+PROXY_SOURCE_MIN_INTERVAL = float(os.getenv("PROXY_SOURCE_MIN_INTERVAL", 5 * 60))
+PROXY_SOURCE_MAX_INTERVAL = float(os.getenv("PROXY_SOURCE_MAX_INTERVAL", 6 * 3600))
 
 USER_AGENTS = [
     "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/114.0.0.0 Safari/537.36",
@@ -43,185 +53,260 @@ def get_headers(site):
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
-async def test_proxy(proxy, timeout=3):
+async def test_proxy(proxy, timeout=PROXY_VALIDATION_TIMEOUT):
     test_url = "http://httpbin.org/ip"
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.get(test_url, proxy=f"http://{proxy}", headers=get_headers("httpbin"), timeout=aiohttp.ClientTimeout(total=timeout)) as response:
-                return response.status == 200
-        except Exception as e:
-            logger.debug(f"Proxy {proxy} gagal: {e}")
-            return False
-
-async def fetch_hide_my_ip_proxies():
-    url = "https://www.hide-my-ip.com/proxylist.shtml"
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.get(url, headers=get_headers("hide-my-ip"), timeout=aiohttp.ClientTimeout(total=10)) as response:
-                response.raise_for_status()
-                text = await response.text()
-                soup = BeautifulSoup(text, "html.parser")
-                proxies = []
-                for row in soup.select("table tr")[1:]:  # Skip header
-                    cols = row.find_all("td")
-                    if len(cols) > 1:
-                        ip = cols[0].text.strip()
-                        port = cols[1].text.strip()
-                        if ip and port and ":" not in ip:
-                            proxies.append(f"{ip}:{port}")
-                return proxies
-        except Exception as e:
-            logger.error(f"❌ Gagal mengambil proxy dari Hide My IP: {e}")
-            return []
-
-async def fetch_proxy_list_download():
-    url = "https://www.proxy-list.download/api/v1/get?type=http&country=ID"
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.get(url, headers=get_headers("proxy-list"), timeout=aiohttp.ClientTimeout(total=10)) as response:
-                response.raise_for_status()
-                text = await response.text()
-                return [p for p in text.splitlines() if p.strip()]
-        except Exception as e:
-            logger.error(f"❌ Gagal mengambil proxy dari Proxy-List.download: {e}")
-            return []
-
-async def fetch_geonode_proxies():
-    url = "https://proxylist.geonode.com/api/proxy-list?limit=500&page=1&sort_by=lastChecked&sort_type=desc&country=ID"
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.get(url, headers=get_headers("proxylist"), timeout=aiohttp.ClientTimeout(total=10)) as response:
-                response.raise_for_status()
-                data = await response.json()
-                if not data.get("data"):
-                    logger.warning("⚠️ Tidak ada data proxy dari Geonode")
-                    return []
-                return [f"{item['ip']}:{item['port']}" for item in data["data"] if item.get("country") == "ID"]
-        except Exception as e:
-            logger.error(f"❌ Gagal mengambil proxy dari Geonode: {e}")
-            return []
-
-async def fetch_free_proxy_list():
-    url = "https://free-proxy-list.net/"
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.get(url, headers=get_headers("free-proxy-list"), timeout=aiohttp.ClientTimeout(total=10)) as response:
-                response.raise_for_status()
-                text = await response.text()
-                soup = BeautifulSoup(text, "html.parser")
-                table = soup.find("table")
-                if not table:
-                    logger.warning("⚠️ Tidak ada tabel proxy di Free Proxy List")
-                    return []
-                proxies = []
-                for row in table.find("tbody").find_all("tr"):
-                    cols = row.find_all("td")
-                    if len(cols) > 3 and cols[3].text.strip() == "Indonesia":
-                        proxies.append(f"{cols[0].text.strip()}:{cols[1].text.strip()}")
-                return proxies
-        except Exception as e:
-            logger.error(f"❌ Gagal mengambil proxy dari Free Proxy List: {e}")
-            return []
-
-async def fetch_proxyscrape_proxies():
-    url = "https://api.proxyscrape.com/v3/free-proxy-list/get?request=displayproxies&protocol=http&timeout=10000&country=id"
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.get(url, headers=get_headers("proxyscrape"), timeout=aiohttp.ClientTimeout(total=10)) as response:
-                response.raise_for_status()
-                text = await response.text()
-                return [p for p in text.splitlines() if p.strip()]
-        except Exception as e:
-            logger.error(f"❌ Gagal mengambil proxy dari Proxyscrape: {e}")
-            return []
-
-async def fetch_proxynova_proxies():
-    url = "https://www.proxynova.com/proxy-server-list/country-id/"
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.get(url, headers=get_headers("proxynova"), timeout=aiohttp.ClientTimeout(total=10)) as response:
-                response.raise_for_status()
-                text = await response.text()
-                soup = BeautifulSoup(text, "html.parser")
-                proxies = []
-                table = soup.find("table", {"id": "tbl_proxy_list"})
-                if not table:
-                    logger.warning("⚠️ Tidak ada tabel proxy di ProxyNova")
-                    return []
-                for row in table.find("tbody").find_all("tr"):
-                    cols = row.find_all("td")
-                    if len(cols) >= 2:
-                        ip = cols[0].text.strip()
-                        port = cols[1].text.strip()
-                        if ip and port:
-                            proxies.append(f"{ip}:{port}")
-                return proxies
-        except Exception as e:
-            logger.error(f"❌ Gagal mengambil proxy dari ProxyNova: {e}")
-            return []
-
-async def fetch_sslproxies_proxies():
-    url = "https://www.sslproxies.org/"
-    async with aiohttp.ClientSession() as session:
-        try:
-            async with session.get(url, headers=get_headers("sslproxies"), timeout=aiohttp.ClientTimeout(total=10)) as response:
-                response.raise_for_status()
-                text = await response.text()
-                soup = BeautifulSoup(text, "html.parser")
-                proxies = []
-                table = soup.find("table", {"class": "table"})
-                if not table:
-                    logger.warning("⚠️ Tidak ada tabel proxy di SSL Proxies")
-                    return []
-                for row in table.find("tbody").find_all("tr"):
-                    cols = row.find_all("td")
-                    if len(cols) > 3 and cols[3].text.strip() == "ID":
-                        proxies.append(f"{cols[0].text.strip()}:{cols[1].text.strip()}")
-                return proxies
-        except Exception as e:
-            logger.error(f"❌ Gagal mengambil proxy dari SSL Proxies: {e}")
-            return []
+    session = get_validation_session()
+    loop = asyncio.get_running_loop()
+    started = loop.time()
+    # Proxy yang tidak bisa dikoneksikan dalam separuh timeout langsung dianggap gagal
+    client_timeout = aiohttp.ClientTimeout(total=timeout, sock_connect=timeout / 2)
+    try:
+        async with session.get(test_url, proxy=f"http://{proxy}", headers=get_headers("httpbin"), timeout=client_timeout) as response:
+            if response.status != 200:
+                return None
+            return loop.time() - started
+    except Exception as e:
+        logger.debug(f"Proxy {proxy} gagal: {e}")
+        return None
 
-async def scrape_and_store_proxies():
-    logger.info("🔄 Scraping dan memvalidasi proxy...")
-    
-    tasks = [
-        fetch_geonode_proxies(),
-        fetch_free_proxy_list(),
-        fetch_proxyscrape_proxies(),
-        fetch_hide_my_ip_proxies(),
-        fetch_proxy_list_download(),
-        fetch_proxynova_proxies(),
-        fetch_sslproxies_proxies()
-    ]
-    results = await asyncio.gather(*tasks)
-    
-    all_proxies = list(set(sum(results, [])))
-    logger.info(f"Total proxy sebelum validasi: {len(all_proxies)}")
-
-    test_tasks = [test_proxy(proxy) for proxy in all_proxies]
-    valid_results = await asyncio.gather(*test_tasks)
-    valid_proxies = [proxy for proxy, is_valid in zip(all_proxies, valid_results) if is_valid]
-    
+async def store_valid_proxies(batch):
     try:
-        if not check_redis_connection():
-            logger.warning("⚠️ Tidak bisa menyimpan proxy karena Redis tidak tersedia")
-            return
-        
-        existing_proxies = redis_client.lrange("proxy_list", 0, -1)
-        new_proxies = [p for p in valid_proxies if p not in existing_proxies]
-        if new_proxies:
-            redis_client.rpush("proxy_list", *new_proxies)
-            logger.info(f"✅ Menambahkan {len(new_proxies)} proxy valid ke Redis. Total proxy sekarang: {redis_client.llen('proxy_list')}")
-        else:
-            logger.info("ℹ️ Tidak ada proxy baru untuk ditambahkan")
+        return await add_proxies(batch)
     except redis.RedisError as e:
         logger.error(f"❌ Gagal menyimpan proxy ke Redis: {e}")
+        return 0
+
+# Validasi berjalan dengan jumlah worker terbatas dan hasilnya ditulis ke Redis per batch,
+# sehingga proxy valid sudah bisa dipakai sebelum seluruh kandidat selesai dites
+async def validate_and_store_proxies(candidates):
+    results = asyncio.Queue()
+    pending = iter(candidates)
+
+    async def worker():
+        for proxy in pending:
+            latency = await test_proxy(proxy)
+            if latency is not None:
+                await results.put((proxy, latency))
 
-def check_redis_connection():
+    async def run_workers():
+        await asyncio.gather(*(worker() for _ in range(min(PROXY_VALIDATION_CONCURRENCY, len(candidates)))))
+        await results.put(None)
+
+    workers_task = asyncio.create_task(run_workers())
+    batch = {}
+    valid = added = 0
     try:
-        redis_client.ping()
-        return True
-    except redis.RedisError as e:
-        logger.error(f"❌ Gagal terhubung ke Redis: {e}")
-        return False
\ No newline at end of file
+        while (item := await results.get()) is not None:
+            proxy, latency = item
+            batch[proxy] = initial_proxy_score(latency)
+            valid += 1
+            if len(batch) >= PROXY_VALIDATION_BATCH_SIZE:
+                added += await store_valid_proxies(batch)
+                batch = {}
+        if batch:
+            added += await store_valid_proxies(batch)
+    finally:
+        workers_task.cancel()
+    return valid, added
+
+# Fetch bersyarat: ETag/Last-Modified dikirim balik ke sumber, dan hash isi dibandingkan untuk sumber yang
+# tidak mendukung 304. Validator baru disimpan setelah parsing berhasil, sehingga halaman yang gagal diparse
+# tetap diproses ulang pada fetch berikutnya. Mengembalikan None jika isi tidak berubah.
+async def fetch_source(name, url, headers):
+    key = f"proxy_source:{name}"
+    etag, last_modified, content_hash = await redis_client.hmget(key, "etag", "last_modified", "content_hash")
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    session = get_session()
+    async with session.get(url, headers=headers, timeout=aiohttp.ClientTimeout(total=10)) as response:
+        if response.status == 304:
+            await redis_client.hincrby(key, "not_modified", 1)
+            logger.debug(f"ℹ️ {name}: 304 Not Modified")
+            return None
+        response.raise_for_status()
+        body = await response.read()
+        validators = {
+            "etag": response.headers.get("ETag", ""),
+            "last_modified": response.headers.get("Last-Modified", ""),
+            "content_hash": hashlib.blake2b(body, digest_size=16).hexdigest(),
+        }
+        pipe = redis_client.pipeline()
+        pipe.hincrby(key, "fetches", 1)
+        pipe.hincrby(key, "bytes_fetched", len(body))
+        pipe.hset(key, "last_bytes", len(body))
+        if validators["content_hash"] == content_hash:
+            pipe.hincrby(key, "unchanged", 1)
+            pipe.hset(key, mapping=validators)
+            await pipe.execute()
+            logger.debug(f"ℹ️ {name}: Isi tidak berubah sejak fetch terakhir")
+            return None
+        await pipe.execute()
+        return body.decode(response.get_encoding(), "replace"), validators
+
+async def record_source_parse(name, validators, elapsed):
+    key = f"proxy_source:{name}"
+    elapsed_ms = elapsed * 1000
+    pipe = redis_client.pipeline()
+    pipe.hset(key, mapping={**validators, "last_parse_ms": round(elapsed_ms, 2)})
+    pipe.hincrbyfloat(key, "parse_ms_total", elapsed_ms)
+    await pipe.execute()
+
+async def parse_hide_my_ip(text):
+    proxies = await run_parser("Hide My IP", extract_hide_my_ip_proxies, text)
+    return [f"{ip}:{port}" for ip, port in proxies]
+
+async def parse_plain_list(text):
+    return [p for p in text.splitlines() if p.strip()]
+
+async def parse_geonode(text):
+    data = json.loads(text)
+    if not data.get("data"):
+        logger.warning("⚠️ Tidak ada data proxy dari Geonode")
+        return []
+    return [f"{item['ip']}:{item['port']}" for item in data["data"] if item.get("country") == "ID"]
+
+async def parse_free_proxy_list(text):
+    proxies = await run_parser("Free Proxy List", extract_free_proxy_list_proxies, text)
+    if proxies is None:
+        logger.warning("⚠️ Tidak ada tabel proxy di Free Proxy List")
+        return []
+    return [f"{ip}:{port}" for ip, port in proxies]
+
+async def parse_proxynova(text):
+    proxies = await run_parser("ProxyNova", extract_proxynova_proxies, text)
+    if proxies is None:
+        logger.warning("⚠️ Tidak ada tabel proxy di ProxyNova")
+        return []
+    return [f"{ip}:{port}" for ip, port in proxies]
+
+async def parse_sslproxies(text):
+    proxies = await run_parser("SSL Proxies", extract_sslproxies_proxies, text)
+    if proxies is None:
+        logger.warning("⚠️ Tidak ada tabel proxy di SSL Proxies")
+        return []
+    return [f"{ip}:{port}" for ip, port in proxies]
+
+# name -> (label, url, referer untuk get_headers, parser)
+PROXY_SOURCES = {
+    "geonode": (
+        "Geonode",
+        "https://proxylist.geonode.com/api/proxy-list?limit=500&page=1&sort_by=lastChecked&sort_type=desc&country=ID",
+        "proxylist",
+        parse_geonode,
+    ),
+    "free-proxy-list": ("Free Proxy List", "https://free-proxy-list.net/", "free-proxy-list", parse_free_proxy_list),
+    "proxyscrape": (
+        "Proxyscrape",
+        "https://api.proxyscrape.com/v3/free-proxy-list/get?request=displayproxies&protocol=http&timeout=10000&country=id",
+        "proxyscrape",
+        parse_plain_list,
+    ),
+    "hide-my-ip": ("Hide My IP", "https://www.hide-my-ip.com/proxylist.shtml", "hide-my-ip", parse_hide_my_ip),
+    "proxy-list-download": (
+        "Proxy-List.download",
+        "https://www.proxy-list.download/api/v1/get?type=http&country=ID",
+        "proxy-list",
+        parse_plain_list,
+    ),
+    "proxynova": ("ProxyNova", "https://www.proxynova.com/proxy-server-list/country-id/", "proxynova", parse_proxynova),
+    "sslproxies": ("SSL Proxies", "https://www.sslproxies.org/", "sslproxies", parse_sslproxies),
+}
+
+# Mengembalikan None jika halaman sumber tidak berubah, sehingga parsing dan validasi dilewati
+async def fetch_proxy_source(name):
+    label, url, referer, parse = PROXY_SOURCES[name]
+    try:
+        page = await fetch_source(name, url, get_headers(referer))
+        if page is None:
+            return None
+        text, validators = page
+        started = time.perf_counter()
+        proxies = await parse(text)
+        await record_source_parse(name, validators, time.perf_counter() - started)
+        return proxies
+    except Exception as e:
+        logger.error(f"❌ Gagal mengambil proxy dari {label}: {e}")
+        return []
+
+async def proxy_source_stats():
+    fields = ("interval", "last_new", "fetches", "not_modified", "unchanged", "bytes_fetched", "last_bytes", "last_parse_ms", "parse_ms_total")
+    pipe = redis_client.pipeline()
+    for name in PROXY_SOURCES:
+        pipe.hmget(f"proxy_source:{name}", *fields)
+    return {
+        name: {field: float(value) if value else 0 for field, value in zip(fields, values)}
+        for name, values in zip(PROXY_SOURCES, await pipe.execute())
+    }
+
+async def revalidate_due_proxies():
+    due = await due_proxies(PROXY_REVALIDATE_BATCH)
+    if not due:
+        return 0
+    latencies = {}
+    pending = iter(due)
+
+    async def worker():
+        for proxy in pending:
+            latencies[proxy] = await test_proxy(proxy)
+
+    await asyncio.gather(*(worker() for _ in range(min(PROXY_VALIDATION_CONCURRENCY, len(due)))))
+    scores = await report_proxies(latencies)
+    await schedule_revalidation(scores)
+    alive = sum(1 for score in scores.values() if score is not None)
+    logger.info(f"🔁 Revalidasi {len(due)} proxy: {alive} masih aktif, {len(due) - alive} dibuang")
+    return len(due)
+
+async def get_source_states():
+    pipe = redis_client.pipeline()
+    for name in PROXY_SOURCES:
+        pipe.hmget(f"proxy_source:{name}", "interval", "next_fetch", "last_new")
+    return {
+        name: {
+            "interval": float(interval or PROXY_SOURCE_MIN_INTERVAL),
+            "next_fetch": float(next_fetch or 0),
+            "last_new": int(last_new or 0),
+        }
+        for name, (interval, next_fetch, last_new) in zip(PROXY_SOURCES, await pipe.execute())
+    }
+
+# Sumber yang menghasilkan proxy baru diambil makin sering, sumber yang isinya itu-itu saja makin jarang
+def update_source_state(pipe, name, state, new_count, now):
+    if new_count:
+        interval = max(PROXY_SOURCE_MIN_INTERVAL, state["interval"] / 2)
+    else:
+        interval = min(PROXY_SOURCE_MAX_INTERVAL, state["interval"] * 2)
+    pipe.hset(f"proxy_source:{name}", mapping={"interval": interval, "next_fetch": now + interval, "last_new": new_count})
+
+# Dipanggil tiap tick scheduler: hanya sumber yang jatuh tempo yang diambil, hanya proxy yang belum pernah
+# dilihat yang dites, dan proxy di pool dicek ulang sesuai jadwal revalidasinya masing-masing
+async def scrape_and_store_proxies():
+    if not await check_redis_connection():
+        logger.warning("⚠️ Tidak bisa menyimpan proxy karena Redis tidak tersedia")
+        return
+
+    now = time.time()
+    states = await get_source_states()
+    due_sources = [name for name, state in states.items() if state["next_fetch"] <= now]
+    if due_sources:
+        logger.info(f"🔄 Mengambil proxy dari {', '.join(due_sources)}")
+        results = await asyncio.gather(*(fetch_proxy_source(name) for name in due_sources))
+        candidates = []
+        pipe = redis_client.pipeline()
+        for name, proxies in zip(due_sources, results):
+            unseen = await filter_unseen_proxies(set(proxies), now) if proxies is not None else []
+            update_source_state(pipe, name, states[name], len(unseen), now)
+            candidates.extend(unseen)
+        await pipe.execute()
+        logger.info(f"Total proxy baru sebelum validasi: {len(candidates)}")
+
+        if candidates:
+            valid, added = await validate_and_store_proxies(candidates)
+            if added:
+                logger.info(f"✅ Menambahkan {added} dari {valid} proxy valid ke Redis. Total proxy sekarang: {await count_proxies()}")
+            else:
+                logger.info(f"ℹ️ Tidak ada proxy baru untuk ditambahkan ({valid} proxy valid)")
+
+    await revalidate_due_proxies()
+    await prune_seen_proxies(now)
@@ -0,0 +1,93 @@
+import logging
+import os
+import time
+import redis
+import redis.asyncio
+
+REDIS_HOST = os.getenv("REDIS_HOST", "redis.railway.internal")
+REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
+REDIS_PASSWORD = os.getenv("REDIS_PASSWORD")
+REDIS_MAX_CONNECTIONS = int(os.getenv("REDIS_MAX_CONNECTIONS", 50))
+REDIS_POOL_TIMEOUT = float(os.getenv("REDIS_POOL_TIMEOUT", 5))
+REDIS_SOCKET_TIMEOUT = float(os.getenv("REDIS_SOCKET_TIMEOUT", 5))
+REDIS_HEALTH_CHECK_INTERVAL = int(os.getenv("REDIS_HEALTH_CHECK_INTERVAL", 30))
+REDIS_RECHECK_INTERVAL = float(os.getenv("REDIS_RECHECK_INTERVAL", 5))
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+# Status koneksi dicatat pasif dari hasil setiap perintah, jadi tidak perlu PING sebelum menulis
+class RedisHealth:
+    def __init__(self):
+        self.available = True
+        self.last_error = None
+        self.changed_at = time.monotonic()
+
+    def mark(self, ok, error=None):
+        if ok == self.available:
+            if not ok:
+                self.last_error = error
+            return
+        self.available = ok
+        self.last_error = error
+        self.changed_at = time.monotonic()
+        if ok:
+            logger.info("✅ Koneksi Redis pulih")
+        else:
+            logger.error(f"❌ Gagal terhubung ke Redis: {error}")
+
+redis_health = RedisHealth()
+
+class TrackedConnection(redis.asyncio.Connection):
+    async def connect(self):
+        try:
+            await super().connect()
+        except (redis.ConnectionError, redis.TimeoutError) as e:
+            redis_health.mark(False, e)
+            raise
+
+    async def read_response(self, *args, **kwargs):
+        try:
+            response = await super().read_response(*args, **kwargs)
+        except (redis.ConnectionError, redis.TimeoutError) as e:
+            redis_health.mark(False, e)
+            raise
+        redis_health.mark(True)
+        return response
+
+def _create_client(decode_responses):
+    pool = redis.asyncio.BlockingConnectionPool(
+        connection_class=TrackedConnection,
+        max_connections=REDIS_MAX_CONNECTIONS,
+        timeout=REDIS_POOL_TIMEOUT,
+        host=REDIS_HOST,
+        port=REDIS_PORT,
+        password=REDIS_PASSWORD,
+        db=0,
+        socket_timeout=REDIS_SOCKET_TIMEOUT,
+        socket_connect_timeout=REDIS_SOCKET_TIMEOUT,
+        health_check_interval=REDIS_HEALTH_CHECK_INTERVAL,
+        decode_responses=decode_responses,
+    )
+    return redis.asyncio.Redis(connection_pool=pool)
+
+redis_client = _create_client(decode_responses=True)
+# Client tanpa decode untuk data biner (record harga dan model n-gram msgpack)
+redis_binary_client = _create_client(decode_responses=False)
+
+# Saat Redis tercatat mati, PING hanya dikirim ulang paling sering sekali per REDIS_RECHECK_INTERVAL
+async def check_redis_connection():
+    if redis_health.available:
+        return True
+    if time.monotonic() - redis_health.changed_at < REDIS_RECHECK_INTERVAL:
+        return False
+    redis_health.changed_at = time.monotonic()
+    try:
+        await redis_client.ping()
+    except redis.RedisError:
+        return False
+    return redis_health.available
+
+async def close_redis():
+    await redis_client.aclose()
+    await redis_binary_client.aclose()
@@ -0,0 +1,118 @@
+import asyncio
+import logging
+import os
+import uuid
+import msgpack
+import redis
+from price_record import PriceRecord
+from redis_store import redis_client, redis_binary_client
+
+SCRAPE_STREAM_KEY = "scrape_jobs"
+SCRAPE_DEAD_LETTER_KEY = "scrape_jobs:dead"
+SCRAPE_GROUP = "scrape_workers"
+SCRAPE_STREAM_MAXLEN = int(os.getenv("SCRAPE_STREAM_MAXLEN", 10000))
+SCRAPE_JOB_TIMEOUT = float(os.getenv("SCRAPE_JOB_TIMEOUT", 170))
+SCRAPE_JOB_RESULT_TTL = int(os.getenv("SCRAPE_JOB_RESULT_TTL", 300))
+SCRAPE_VISIBILITY_TIMEOUT = int(os.getenv("SCRAPE_VISIBILITY_TIMEOUT", 60))
+SCRAPE_MAX_DELIVERIES = int(os.getenv("SCRAPE_MAX_DELIVERIES", 3))
+# Harus lebih pendek dari REDIS_SOCKET_TIMEOUT karena BLPOP/XREADGROUP menahan koneksi selama menunggu
+SCRAPE_BLOCK_SECONDS = float(os.getenv("SCRAPE_BLOCK_SECONDS", 2))
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+# Alur job: bot XADD ke stream scrape_jobs, worker membaca lewat consumer group scrape_workers, lalu progres dan
+# hasil dikirim balik lewat list scrape_job:<id> yang ditunggu bot dengan BLPOP. Job baru di-XACK setelah hasil
+# dipublikasikan; job milik worker yang mati diambil alih worker lain lewat XAUTOCLAIM setelah visibility timeout.
+def job_events_key(job_id):
+    return f"scrape_job:{job_id}"
+
+async def ensure_scrape_group():
+    try:
+        await redis_client.xgroup_create(SCRAPE_STREAM_KEY, SCRAPE_GROUP, id="0", mkstream=True)
+        logger.info(f"✅ Consumer group {SCRAPE_GROUP} dibuat")
+    except redis.ResponseError as e:
+        if "BUSYGROUP" not in str(e):
+            raise
+
+async def enqueue_scrape_job(query):
+    job_id = uuid.uuid4().hex
+    await redis_client.xadd(
+        SCRAPE_STREAM_KEY, {"job_id": job_id, "query": query}, maxlen=SCRAPE_STREAM_MAXLEN, approximate=True
+    )
+    return job_id
+
+async def publish_job_event(job_id, event, done=0, total=0, record=None):
+    payload = msgpack.packb([event, done, total, record.pack() if record else None])
+    pipe = redis_binary_client.pipeline()
+    pipe.rpush(job_events_key(job_id), payload)
+    pipe.expire(job_events_key(job_id), SCRAPE_JOB_RESULT_TTL)
+    await pipe.execute()
+
+# Dipakai bot: kirim job lalu tunggu event progres sampai hasil akhir, error, atau timeout
+async def run_scrape_job(query, on_progress=None):
+    job_id = await enqueue_scrape_job(query)
+    logger.info(f"📨 Job scraping {job_id} untuk '{query}' masuk antrean")
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + SCRAPE_JOB_TIMEOUT
+    try:
+        while loop.time() < deadline:
+            item = await redis_binary_client.blpop(
+                job_events_key(job_id), timeout=max(1, min(SCRAPE_BLOCK_SECONDS, deadline - loop.time()))
+            )
+            if item is None:
+                continue
+            event, done, total, packed = msgpack.unpackb(item[1])
+            record = PriceRecord.unpack(packed) if packed else None
+            if event == "progress":
+                if on_progress:
+                    try:
+                        await on_progress(done, total, record)
+                    except Exception as e:
+                        logger.warning(f"⚠️ Gagal mengirim progres harga: {e}")
+                continue
+            if event == "error":
+                logger.error(f"❌ Job scraping {job_id} untuk '{query}' gagal di worker")
+            return record
+        logger.error(f"❌ Job scraping {job_id} untuk '{query}' tidak selesai dalam {SCRAPE_JOB_TIMEOUT:.0f} detik")
+        return None
+    finally:
+        await redis_binary_client.delete(job_events_key(job_id))
+
+async def read_scrape_jobs(consumer, count):
+    response = await redis_client.xreadgroup(
+        SCRAPE_GROUP, consumer, {SCRAPE_STREAM_KEY: ">"}, count=count, block=int(SCRAPE_BLOCK_SECONDS * 1000)
+    )
+    return [(entry_id, fields) for _, entries in response or [] for entry_id, fields in entries]
+
+# Job yang terlalu lama tidak di-ACK (worker crash) diambil alih. Job yang sudah berkali-kali gagal
+# dipindahkan ke dead-letter stream dan bot yang menunggu langsung diberi tahu
+async def claim_stale_jobs(consumer, count):
+    _, entries, *_ = await redis_client.xautoclaim(
+        SCRAPE_STREAM_KEY, SCRAPE_GROUP, consumer, SCRAPE_VISIBILITY_TIMEOUT * 1000, start_id="0-0", count=count
+    )
+    claimed = []
+    for entry_id, fields in entries:
+        if not fields:
+            continue
+        pending = await redis_client.xpending_range(SCRAPE_STREAM_KEY, SCRAPE_GROUP, min=entry_id, max=entry_id, count=1)
+        deliveries = pending[0]["times_delivered"] if pending else 1
+        if deliveries > SCRAPE_MAX_DELIVERIES:
+            logger.error(f"☠️ Job {fields.get('job_id')} ('{fields.get('query')}') gagal {deliveries - 1}x, dipindah ke dead-letter")
+            await redis_client.xadd(SCRAPE_DEAD_LETTER_KEY, fields, maxlen=SCRAPE_STREAM_MAXLEN, approximate=True)
+            await publish_job_event(fields["job_id"], "error")
+            await ack_scrape_job(entry_id)
+            continue
+        logger.warning(f"♻️ Mengambil alih job {fields.get('job_id')} ('{fields.get('query')}'), percobaan ke-{deliveries}")
+        claimed.append((entry_id, fields))
+    return claimed
+
+# Worker yang masih mengerjakan job me-reset idle time-nya agar tidak diambil alih worker lain
+async def extend_scrape_job(consumer, entry_id):
+    await redis_client.xclaim(SCRAPE_STREAM_KEY, SCRAPE_GROUP, consumer, 0, [entry_id], justid=True)
+
+async def ack_scrape_job(entry_id):
+    pipe = redis_client.pipeline()
+    pipe.xack(SCRAPE_STREAM_KEY, SCRAPE_GROUP, entry_id)
+    pipe.xdel(SCRAPE_STREAM_KEY, entry_id)
+    await pipe.execute()
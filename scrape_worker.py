@@ -0,0 +1,92 @@
+import asyncio
+import logging
+import os
+import signal
+import socket
+from http_client import init_http_sessions, close_http_sessions
+from parse_pool import get_parse_pool, shutdown_parse_pool
+from price_scraper import scrape_all_sites
+from redis_store import close_redis
+from log_store import install_log_handler, run_log_shipper, flush_logs
+from scrape_queue import (
+    SCRAPE_VISIBILITY_TIMEOUT, ensure_scrape_group, read_scrape_jobs, claim_stale_jobs,
+    extend_scrape_job, ack_scrape_job, publish_job_event,
+)
+
+SCRAPE_WORKER_CONCURRENCY = int(os.getenv("SCRAPE_WORKER_CONCURRENCY", 4))
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+async def keep_job_visible(consumer, entry_id):
+    while True:
+        await asyncio.sleep(SCRAPE_VISIBILITY_TIMEOUT / 3)
+        await extend_scrape_job(consumer, entry_id)
+
+# Job hanya di-ACK setelah hasil (atau kegagalan yang tertangani) dipublikasikan. Jika proses mati di tengah
+# jalan, job tetap pending dan diambil alih worker lain setelah visibility timeout
+async def process_job(consumer, entry_id, fields):
+    job_id, query = fields["job_id"], fields["query"]
+    logger.info(f"⚙️ Worker {consumer} memproses job {job_id}: '{query}'")
+
+    async def report_progress(done, total, record):
+        await publish_job_event(job_id, "progress", done, total, record)
+
+    heartbeat = asyncio.create_task(keep_job_visible(consumer, entry_id))
+    try:
+        result = await scrape_all_sites(query, on_progress=report_progress)
+        await publish_job_event(job_id, "result", record=result)
+    except Exception as e:
+        logger.error(f"❌ Job {job_id} untuk '{query}' gagal: {e}")
+        await publish_job_event(job_id, "error")
+    finally:
+        heartbeat.cancel()
+    await ack_scrape_job(entry_id)
+
+async def run_scrape_worker(consumer, stop_event):
+    await ensure_scrape_group()
+    running = set()
+    logger.info(f"🚀 Scrape worker {consumer} berjalan dengan {SCRAPE_WORKER_CONCURRENCY} slot")
+    while not stop_event.is_set():
+        free = SCRAPE_WORKER_CONCURRENCY - len(running)
+        if free <= 0:
+            await asyncio.wait(running, return_when=asyncio.FIRST_COMPLETED)
+            continue
+        try:
+            jobs = await claim_stale_jobs(consumer, free)
+            if not jobs:
+                jobs = await read_scrape_jobs(consumer, free)
+        except Exception as e:
+            logger.error(f"❌ Gagal membaca antrean scraping: {e}")
+            await asyncio.sleep(1)
+            continue
+        for entry_id, fields in jobs:
+            task = asyncio.create_task(process_job(consumer, entry_id, fields))
+            running.add(task)
+            task.add_done_callback(running.discard)
+    if running:
+        logger.info(f"⏳ Menunggu {len(running)} job selesai sebelum berhenti...")
+        await asyncio.wait(running)
+
+async def main():
+    consumer = f"{socket.gethostname()}-{os.getpid()}"
+    install_log_handler(consumer)
+    log_task = asyncio.create_task(run_log_shipper())
+    await init_http_sessions()
+    get_parse_pool()
+    stop_event = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop_event.set)
+    try:
+        await run_scrape_worker(consumer, stop_event)
+    finally:
+        await close_http_sessions()
+        shutdown_parse_pool()
+        logger.info(f"✅ Scrape worker {consumer} berhenti")
+        log_task.cancel()
+        await flush_logs()
+        await close_redis()
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,94 @@
+import asyncio
+import json
+import logging
+import os
+import uuid
+import redis
+from redis_store import redis_client, redis_binary_client
+
+SINGLEFLIGHT_LOCK_TTL = int(os.getenv("SINGLEFLIGHT_LOCK_TTL", 200))
+SINGLEFLIGHT_RESULT_TTL = int(os.getenv("SINGLEFLIGHT_RESULT_TTL", 30))
+SINGLEFLIGHT_POLL_INTERVAL = float(os.getenv("SINGLEFLIGHT_POLL_INTERVAL", 0.5))
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+# Hapus lock hanya jika masih dipegang oleh replika yang sama
+RELEASE_LOCK_SCRIPT = redis_client.register_script("""
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+""")
+
+_MISSING = object()
+_inflight = {}
+
+def _encode_json(result):
+    return json.dumps(result).encode()
+
+async def _read_published_result(result_key, decode):
+    payload = await redis_binary_client.get(result_key)
+    return _MISSING if payload is None else decode(payload)
+
+async def _wait_for_leader(lock_key, result_key, decode):
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + SINGLEFLIGHT_LOCK_TTL
+    while loop.time() < deadline:
+        result = await _read_published_result(result_key, decode)
+        if result is not _MISSING:
+            return result
+        if not await redis_client.exists(lock_key):
+            # Leader selesai tanpa hasil (error/crash), cek sekali lagi sebelum menyerah
+            return await _read_published_result(result_key, decode)
+        await asyncio.sleep(SINGLEFLIGHT_POLL_INTERVAL)
+    return _MISSING
+
+async def _run_across_replicas(key, func, encode, decode):
+    lock_key = f"singleflight:lock:{key}"
+    result_key = f"singleflight:result:{key}"
+    token = uuid.uuid4().hex
+    try:
+        result = await _read_published_result(result_key, decode)
+        if result is not _MISSING:
+            logger.info(f"🔗 Menggunakan hasil yang baru dipublikasikan untuk '{key}'")
+            return result
+        if not await redis_client.set(lock_key, token, nx=True, ex=SINGLEFLIGHT_LOCK_TTL):
+            logger.info(f"🔗 Replika lain sedang mencari '{key}', menunggu hasilnya...")
+            result = await _wait_for_leader(lock_key, result_key, decode)
+            if result is not _MISSING:
+                return result
+            logger.warning(f"⚠️ Tidak ada hasil dari replika lain untuk '{key}', mencari sendiri")
+    except redis.RedisError as e:
+        logger.warning(f"⚠️ Single-flight Redis tidak tersedia, hanya dedup lokal: {e}")
+        return await func()
+
+    try:
+        result = await func()
+        try:
+            await redis_binary_client.set(result_key, encode(result), ex=SINGLEFLIGHT_RESULT_TTL)
+        except redis.RedisError as e:
+            logger.warning(f"⚠️ Gagal mempublikasikan hasil single-flight '{key}': {e}")
+        return result
+    finally:
+        try:
+            await RELEASE_LOCK_SCRIPT(keys=[lock_key], args=[token])
+        except redis.RedisError as e:
+            logger.warning(f"⚠️ Gagal melepas lock single-flight '{key}': {e}")
+
+def _finish_flight(key, task):
+    if _inflight.get(key) is task:
+        del _inflight[key]
+    if not task.cancelled():
+        task.exception()  # Tandai sudah diambil agar tidak ada warning jika semua pemanggil sudah timeout
+
+async def single_flight(key, func, encode=_encode_json, decode=json.loads):
+    # Pencarian berjalan sebagai task terpisah sehingga timeout satu pemanggil tidak membatalkan yang lain
+    task = _inflight.get(key)
+    if task is None:
+        task = asyncio.create_task(_run_across_replicas(key, func, encode, decode))
+        _inflight[key] = task
+        task.add_done_callback(lambda t: _finish_flight(key, t))
+    else:
+        logger.info(f"🔗 Bergabung dengan pencarian yang sedang berjalan untuk '{key}'")
+    return await asyncio.shield(task)
@@ -0,0 +1,113 @@
+import logging
+import os
+import time
+from collections import deque
+
+SITE_HEALTH_WINDOW = int(os.getenv("SITE_HEALTH_WINDOW", 50))
+SITE_HEALTH_MIN_SAMPLES = int(os.getenv("SITE_HEALTH_MIN_SAMPLES", 5))
+SITE_FAILURE_THRESHOLD = float(os.getenv("SITE_FAILURE_THRESHOLD", 0.6))
+SITE_CIRCUIT_COOLDOWN = float(os.getenv("SITE_CIRCUIT_COOLDOWN", 120))
+SITE_TIMEOUT_MIN = float(os.getenv("SITE_TIMEOUT_MIN", 3))
+SITE_TIMEOUT_MAX = float(os.getenv("SITE_TIMEOUT_MAX", 15))
+SITE_TIMEOUT_MULTIPLIER = float(os.getenv("SITE_TIMEOUT_MULTIPLIER", 1.5))
+SITE_RETRY_BUDGET_RATIO = float(os.getenv("SITE_RETRY_BUDGET_RATIO", 0.2))
+SITE_RETRY_BUDGET_MAX = float(os.getenv("SITE_RETRY_BUDGET_MAX", 10))
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[int(fraction * (len(ordered) - 1))]
+
+class SiteHealth:
+    def __init__(self, site):
+        self.site = site
+        self.samples = deque(maxlen=SITE_HEALTH_WINDOW)
+        self.opened_at = None
+        self.probing = False
+        self.probe_started_at = None
+        self.retry_tokens = SITE_RETRY_BUDGET_MAX
+
+    def success_rate(self):
+        if not self.samples:
+            return 1.0
+        return sum(1 for ok, _ in self.samples if ok) / len(self.samples)
+
+    def latency_p95(self):
+        latencies = [latency for ok, latency in self.samples if ok]
+        return percentile(latencies, 0.95) if len(latencies) >= SITE_HEALTH_MIN_SAMPLES else None
+
+    # Circuit: closed -> open (skip situs selama cooldown) -> half-open (satu request percobaan)
+    def allow_request(self):
+        if self.opened_at is None:
+            self.retry_tokens = min(SITE_RETRY_BUDGET_MAX, self.retry_tokens + SITE_RETRY_BUDGET_RATIO)
+            return True
+        now = time.monotonic()
+        # Probe yang tidak pernah melapor (mis. task-nya dibatalkan) dianggap hilang setelah timeout maksimum
+        if self.probing and now - self.probe_started_at > SITE_TIMEOUT_MAX:
+            self.abandon_probe()
+        if now - self.opened_at < SITE_CIRCUIT_COOLDOWN or self.probing:
+            return False
+        self.probing = True
+        self.probe_started_at = now
+        logger.info(f"🔌 {self.site}: Circuit half-open, mengirim request percobaan")
+        return True
+
+    def can_retry(self):
+        if self.opened_at is not None or self.retry_tokens < 1:
+            return False
+        self.retry_tokens -= 1
+        return True
+
+    def timeout(self):
+        p95 = self.latency_p95()
+        if p95 is None:
+            return SITE_TIMEOUT_MAX
+        return min(SITE_TIMEOUT_MAX, max(SITE_TIMEOUT_MIN, p95 * SITE_TIMEOUT_MULTIPLIER))
+
+    # Latensi hanya diberikan untuk request yang sukses; kegagalan tidak ikut menentukan timeout
+    def record(self, ok, latency=None):
+        self.samples.append((ok, latency))
+        if self.probing:
+            self.probing = False
+            if ok:
+                self.close()
+            else:
+                self.open()
+        elif self.opened_at is None and len(self.samples) >= SITE_HEALTH_MIN_SAMPLES and 1 - self.success_rate() >= SITE_FAILURE_THRESHOLD:
+            self.open()
+
+    # Probe berakhir tanpa hasil (dibatalkan atau error lain): circuit tetap open dan probe berikutnya boleh dikirim
+    def abandon_probe(self):
+        self.probing = False
+        self.probe_started_at = None
+
+    def open(self):
+        self.opened_at = time.monotonic()
+        logger.warning(f"🔌 {self.site}: Circuit dibuka, situs dilewati selama {SITE_CIRCUIT_COOLDOWN:.0f} detik (sukses {self.success_rate():.0%})")
+
+    def close(self):
+        self.opened_at = None
+        self.samples.clear()
+        logger.info(f"✅ {self.site}: Circuit ditutup kembali")
+
+    def snapshot(self):
+        return {
+            "state": "closed" if self.opened_at is None else ("half-open" if self.probing else "open"),
+            "success_rate": round(self.success_rate(), 3),
+            "p95": self.latency_p95(),
+            "timeout": self.timeout(),
+            "retry_tokens": round(self.retry_tokens, 2),
+        }
+
+_site_health = {}
+
+def get_site_health(site):
+    health = _site_health.get(site)
+    if health is None:
+        health = _site_health[site] = SiteHealth(site)
+    return health
+
+def site_health_snapshot():
+    return {site: health.snapshot() for site, health in _site_health.items()}
@@ -0,0 +1,79 @@
+import json
+import logging
+import os
+import re
+import time
+from collections import OrderedDict
+import redis
+from redis_store import redis_client
+
+SUGGESTION_CACHE_TTL = int(os.getenv("SUGGESTION_CACHE_TTL", 6 * 3600))
+SUGGESTION_CACHE_LOCAL_TTL = float(os.getenv("SUGGESTION_CACHE_LOCAL_TTL", 10 * 60))
+SUGGESTION_CACHE_LOCAL_SIZE = int(os.getenv("SUGGESTION_CACHE_LOCAL_SIZE", 2000))
+SUGGESTION_CACHE_MIN_PREFIX = int(os.getenv("SUGGESTION_CACHE_MIN_PREFIX", 3))
+
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger(__name__)
+
+# prefix -> (expires_at, suggestions, complete), urut LRU
+_local_cache = OrderedDict()
+
+def normalize_prefix(text):
+    return re.sub(r"\s+", " ", text.lower()).lstrip()
+
+def _local_get(prefix, now):
+    entry = _local_cache.get(prefix)
+    if entry is None:
+        return None
+    if entry[0] < now:
+        del _local_cache[prefix]
+        return None
+    _local_cache.move_to_end(prefix)
+    return entry[1], entry[2]
+
+def _local_put(prefix, suggestions, complete, now):
+    _local_cache[prefix] = (now + SUGGESTION_CACHE_LOCAL_TTL, suggestions, complete)
+    _local_cache.move_to_end(prefix)
+    while len(_local_cache) > SUGGESTION_CACHE_LOCAL_SIZE:
+        _local_cache.popitem(last=False)
+
+def _narrow(suggestions, prefix):
+    return [suggestion for suggestion in suggestions if normalize_prefix(suggestion).startswith(prefix)]
+
+# Hasil "complete" berarti provider mengembalikan lebih sedikit dari batasnya, jadi semua saran untuk prefix itu
+# sudah ada di cache. Hasil seperti itu juga menjawab prefix yang lebih panjang cukup dengan difilter.
+async def get_cached_suggestions(text):
+    prefix = normalize_prefix(text)
+    if len(prefix) < SUGGESTION_CACHE_MIN_PREFIX:
+        return None
+    now = time.time()
+    candidates = [prefix[:length] for length in range(len(prefix), SUGGESTION_CACHE_MIN_PREFIX - 1, -1)]
+    for candidate in candidates:
+        entry = _local_get(candidate, now)
+        if entry is not None and (candidate == prefix or entry[1]):
+            return _narrow(entry[0], prefix)
+    try:
+        values = await redis_client.mget([f"suggest:{candidate}" for candidate in candidates])
+    except redis.RedisError as e:
+        logger.warning(f"⚠️ Gagal membaca cache saran dari Redis: {e}")
+        return None
+    for candidate, value in zip(candidates, values):
+        if value is None:
+            continue
+        entry = json.loads(value)
+        if candidate == prefix or entry["complete"]:
+            _local_put(candidate, entry["suggestions"], entry["complete"], now)
+            return _narrow(entry["suggestions"], prefix)
+    return None
+
+async def cache_suggestions(text, suggestions, complete):
+    prefix = normalize_prefix(text)
+    if len(prefix) < SUGGESTION_CACHE_MIN_PREFIX:
+        return
+    _local_put(prefix, suggestions, complete, time.time())
+    try:
+        await redis_client.set(
+            f"suggest:{prefix}", json.dumps({"suggestions": suggestions, "complete": complete}), ex=SUGGESTION_CACHE_TTL
+        )
+    except redis.RedisError as e:
+        logger.warning(f"⚠️ Gagal menyimpan cache saran ke Redis: {e}")
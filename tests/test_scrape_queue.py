@@ -0,0 +1,113 @@
+import asyncio
+import os
+import sys
+import uuid
+import msgpack
+import pytest
+
+# Butuh Redis lokal (REDIS_HOST/REDIS_PORT); test dilewati jika tidak bisa dihubungi
+os.environ.setdefault("REDIS_HOST", "localhost")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import redis
+import scrape_queue
+import scrape_worker
+from price_record import PriceRecord, SitePrice
+from redis_store import redis_client, redis_binary_client
+
+def run(coro):
+    async def runner():
+        try:
+            return await coro
+        finally:
+            # Koneksi terikat ke event loop, jadi dilepas sebelum asyncio.run berikutnya membuat loop baru
+            await redis_client.connection_pool.disconnect()
+            await redis_binary_client.connection_pool.disconnect()
+    return asyncio.run(runner())
+
+@pytest.fixture(autouse=True)
+def isolated_queue(monkeypatch):
+    try:
+        run(redis_client.ping())
+    except redis.RedisError as e:
+        pytest.skip(f"Redis lokal tidak tersedia: {e}")
+    suffix = uuid.uuid4().hex
+    monkeypatch.setattr(scrape_queue, "SCRAPE_STREAM_KEY", f"test:scrape_jobs:{suffix}")
+    monkeypatch.setattr(scrape_queue, "SCRAPE_DEAD_LETTER_KEY", f"test:scrape_jobs:dead:{suffix}")
+    monkeypatch.setattr(scrape_queue, "SCRAPE_BLOCK_SECONDS", 0.2)
+    yield
+    run(redis_client.delete(scrape_queue.SCRAPE_STREAM_KEY, scrape_queue.SCRAPE_DEAD_LETTER_KEY))
+
+@pytest.fixture
+def fake_scrape(monkeypatch):
+    queries = []
+
+    async def scrape_all_sites(query, on_progress=None):
+        queries.append(query)
+        record = PriceRecord(1000, 3000, 2000, sites={"tokopedia": SitePrice(1000, 3000, 2000, 5)})
+        if on_progress:
+            await on_progress(1, 1, record)
+        return record
+
+    monkeypatch.setattr(scrape_worker, "scrape_all_sites", scrape_all_sites)
+    return queries
+
+async def pending_count():
+    summary = await redis_client.xpending(scrape_queue.SCRAPE_STREAM_KEY, scrape_queue.SCRAPE_GROUP)
+    return summary["pending"]
+
+async def with_worker(consumer, scenario):
+    stop_event = asyncio.Event()
+    worker = asyncio.create_task(scrape_worker.run_scrape_worker(consumer, stop_event))
+    try:
+        return await asyncio.wait_for(scenario(), timeout=10)
+    finally:
+        stop_event.set()
+        await asyncio.wait_for(worker, timeout=5)
+
+def test_enqueue_worker_result_round_trip(fake_scrape):
+    progress = []
+
+    async def on_progress(done, total, record):
+        progress.append((done, total, record.avg))
+
+    async def scenario():
+        record = await with_worker("worker-a", lambda: scrape_queue.run_scrape_job("iphone 13", on_progress=on_progress))
+        return record, await pending_count()
+
+    record, pending = run(scenario())
+    assert fake_scrape == ["iphone 13"]
+    assert progress == [(1, 1, 2000)]
+    assert (record.min, record.max, record.avg) == (1000, 3000, 2000)
+    assert record.sites["tokopedia"].samples == 5
+    assert pending == 0
+
+def test_job_of_crashed_worker_is_reclaimed(fake_scrape, monkeypatch):
+    monkeypatch.setattr(scrape_queue, "SCRAPE_VISIBILITY_TIMEOUT", 1)
+
+    async def scenario():
+        await scrape_queue.ensure_scrape_group()
+        job_id = await scrape_queue.enqueue_scrape_job("samsung a54")
+        # Worker pertama menerima job lalu mati sebelum mempublikasikan hasil dan XACK
+        jobs = await scrape_queue.read_scrape_jobs("worker-crashed", 1)
+        assert [fields["job_id"] for _, fields in jobs] == [job_id]
+        await asyncio.sleep(scrape_queue.SCRAPE_VISIBILITY_TIMEOUT + 0.2)
+
+        async def wait_result():
+            while True:
+                item = await redis_binary_client.blpop(scrape_queue.job_events_key(job_id), timeout=1)
+                if item is not None:
+                    event, *_ = msgpack.unpackb(item[1])
+                    if event != "progress":
+                        return event
+
+        try:
+            event = await with_worker("worker-b", wait_result)
+        finally:
+            await redis_binary_client.delete(scrape_queue.job_events_key(job_id))
+        return event, await pending_count()
+
+    event, pending = run(scenario())
+    assert event == "result"
+    assert fake_scrape == ["samsung a54"]
+    assert pending == 0
@@ -1,42 +1,219 @@
 import redis
 import re
+import json
 from statistics import mean, median
 import logging
 import os
-
-REDIS_HOST = os.getenv("REDIS_HOST", "redis.railway.internal")
-REDIS_PORT = int(os.getenv("REDIS_PORT", 6379))
-REDIS_PASSWORD = os.getenv("REDIS_PASSWORD")
-redis_client = redis.Redis(host=REDIS_HOST, port=REDIS_PORT, password=REDIS_PASSWORD, db=0, decode_responses=True)
+import time
+from price_record import PriceRecord
+from redis_store import redis_client, redis_binary_client
+from dashboard_events import queue_dashboard_event, publish_dashboard_event
 
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
 logger = logging.getLogger(__name__)
 
-def load_chat_history():
-    return redis_client.lrange("chat_history", 0, -1) or []
+CHAT_HISTORY_MAX_ENTRIES = int(os.getenv("CHAT_HISTORY_MAX_ENTRIES", 20000))
+CHAT_HISTORY_PREFIX_SCAN = int(os.getenv("CHAT_HISTORY_PREFIX_SCAN", 50))
+
+# Chat history disimpan di dua sorted set: chat_history:lex (semua skor 0, untuk prefix lookup ZRANGEBYLEX)
+# dan chat_history:freq (skor = berapa kali teks muncul, untuk ranking dan eviction entri yang jarang dipakai)
+async def load_chat_history(limit=-1):
+    return await redis_client.zrevrange("chat_history:freq", 0, limit) or []
+
+async def count_chat_history():
+    return await redis_client.zcard("chat_history:freq")
 
-def save_chat_history(text):
-    if not check_redis_connection():
-        logger.warning(f"⚠️ Tidak bisa menyimpan '{text}' ke chat history karena Redis tidak tersedia")
+async def save_chat_history(text, count=1):
+    try:
+        pipe = redis_client.pipeline()
+        pipe.zadd("chat_history:lex", {text: 0}, nx=True)
+        pipe.zincrby("chat_history:freq", count, text)
+        pipe.zcard("chat_history:freq")
+        added, _, size = await pipe.execute()
+    except redis.RedisError as e:
+        logger.warning(f"⚠️ Tidak bisa menyimpan '{text}' ke chat history karena Redis tidak tersedia: {e}")
         return
-    if text not in redis_client.lrange("chat_history", 0, -1):
-        redis_client.rpush("chat_history", text)
+    if added:
         logger.info(f"📌 Menambahkan '{text}' ke chat history di Redis")
+        await publish_dashboard_event("chat_history", "add", [text])
+    if size > CHAT_HISTORY_MAX_ENTRIES:
+        await evict_chat_history(size - CHAT_HISTORY_MAX_ENTRIES)
+
+async def remove_chat_history(text):
+    pipe = redis_client.pipeline()
+    pipe.zrem("chat_history:freq", text)
+    pipe.zrem("chat_history:lex", text)
+    queue_dashboard_event(pipe, "chat_history", "remove", [text])
+    return (await pipe.execute())[0]
+
+async def evict_chat_history(count):
+    rare = [text for text, _ in await redis_client.zpopmin("chat_history:freq", count)]
+    if rare:
+        pipe = redis_client.pipeline()
+        pipe.zrem("chat_history:lex", *rare)
+        queue_dashboard_event(pipe, "chat_history", "remove", rare)
+        await pipe.execute()
+        logger.info(f"🗑️ {len(rare)} entri chat history yang jarang dipakai dibuang")
+
+async def search_chat_history(prefix, limit=4):
+    matches = await redis_client.zrangebylex(
+        "chat_history:lex", f"[{prefix}", f"[{prefix}\U0010ffff", start=0, num=CHAT_HISTORY_PREFIX_SCAN
+    )
+    if not matches:
+        return []
+    counts = await redis_client.zmscore("chat_history:freq", matches)
+    ranked = sorted(zip(matches, counts), key=lambda item: -(item[1] or 0))
+    return [text for text, _ in ranked[:limit]]
+
+async def migrate_chat_history():
+    if await redis_client.type("chat_history") != "list":
+        return
+    entries = await redis_client.lrange("chat_history", 0, -1)
+    counts = {}
+    for entry in entries:
+        counts[entry] = counts.get(entry, 0) + 1
+    pipe = redis_client.pipeline()
+    for entry, count in counts.items():
+        pipe.zadd("chat_history:lex", {entry: 0})
+        pipe.zincrby("chat_history:freq", count, entry)
+    pipe.delete("chat_history")
+    await pipe.execute()
+    logger.info(f"✅ Memindahkan {len(counts)} entri chat_history ke index autocomplete")
+
+async def load_price_history():
+    history = await redis_binary_client.hgetall("price_history") or {}
+    return {key.decode(): PriceRecord.unpack(value) for key, value in history.items()}
+
+PRICE_CACHE_TTL = int(os.getenv("PRICE_CACHE_TTL", 6 * 3600))
+PRICE_CACHE_STALE_TTL = int(os.getenv("PRICE_CACHE_STALE_TTL", 3 * 24 * 3600))
+PRICE_CACHE_MAX_ENTRIES = int(os.getenv("PRICE_CACHE_MAX_ENTRIES", 5000))
+PRICE_INDEX_VERSION = "3"
+PRICE_INDEX_PREFIX_EXPANSIONS = int(os.getenv("PRICE_INDEX_PREFIX_EXPANSIONS", 20))
 
-def load_price_history():
-    return redis_client.hgetall("price_history") or {}
+def tokenize_price_key(text):
+    return list(dict.fromkeys(re.findall(r"\w+", text.lower())))
 
-def save_price_history(question, answer):
-    redis_client.hset("price_history", question, answer)
-    logger.info(f"💾 Menyimpan harga ke Redis: {question} -> {answer}")
+# Inverted index: price_index:<token> berisi key price_history dengan skor jumlah token key,
+# sehingga key yang paling mendekati query (token tambahan paling sedikit) muncul duluan
+# Perintah hanya ditambahkan ke pipeline pemanggil, eksekusinya digabung dengan penulisan record
+def index_price_key(key, pipe):
+    tokens = tokenize_price_key(key)
+    for token in tokens:
+        pipe.zadd(f"price_index:{token}", {key: len(tokens)})
+        pipe.zadd("price_index:tokens", {token: 0})
 
-def find_price_in_history(question):
-    history = load_price_history()
-    for q, a in history.items():
-        if question.lower() in q.lower():
-            logger.info(f"🔄 Menggunakan harga dari history untuk '{question}'")
-            return a
-    return None
+async def unindex_price_key(key):
+    tokens = tokenize_price_key(key)
+    pipe = redis_client.pipeline()
+    for token in tokens:
+        pipe.zrem(f"price_index:{token}", key)
+        pipe.zcard(f"price_index:{token}")
+    results = await pipe.execute()
+    empty_tokens = [token for token, remaining in zip(tokens, results[1::2]) if remaining == 0]
+    if empty_tokens:
+        await redis_client.zrem("price_index:tokens", *empty_tokens)
+
+async def migrate_price_history_index():
+    if await redis_client.get("price_index:version") == PRICE_INDEX_VERSION:
+        return
+    logger.info("🔄 Membangun index price_history...")
+    count = 0
+    pipe = redis_client.pipeline()
+    # HKEYS, bukan HSCAN NOVALUES (baru ada di Redis 7.4); isi hash dibatasi PRICE_CACHE_MAX_ENTRIES dan nilainya
+    # biner sehingga tidak bisa ikut dibaca lewat client yang men-decode respons
+    for key in await redis_client.hkeys("price_history"):
+        index_price_key(key, pipe)
+        # Entri lama tanpa data akses dianggap paling jarang dipakai
+        pipe.zadd("price_history:access", {key: 0}, nx=True)
+        count += 1
+        if count % 500 == 0:
+            await pipe.execute()
+    # Timestamp kini disimpan di dalam record harga
+    pipe.delete("price_history:updated")
+    pipe.set("price_index:version", PRICE_INDEX_VERSION)
+    await pipe.execute()
+    logger.info(f"✅ Index price_history selesai untuk {count} entri")
+
+async def save_price_history(question, record):
+    pipe = redis_binary_client.pipeline()
+    pipe.hset("price_history", question, record.pack())
+    pipe.zadd("price_history:access", {question: time.time()})
+    index_price_key(question, pipe)
+    queue_dashboard_event(pipe, "price_history", "add", [question], [json.dumps(record.to_display())])
+    pipe.zcard("price_history:access")
+    size = (await pipe.execute())[-1]
+    logger.info(f"💾 Menyimpan harga ke Redis: {question} -> {record.min:,}-{record.max:,} dari {record.sources}")
+    if size > PRICE_CACHE_MAX_ENTRIES:
+        await evict_price_history(size - PRICE_CACHE_MAX_ENTRIES)
+
+async def remove_price_history(key):
+    pipe = redis_client.pipeline()
+    pipe.hdel("price_history", key)
+    pipe.zrem("price_history:access", key)
+    queue_dashboard_event(pipe, "price_history", "remove", [key])
+    deleted = (await pipe.execute())[0]
+    await unindex_price_key(key)
+    return deleted
+
+# Eviction LRU: entri yang paling lama tidak diakses dibuang saat jumlah entri melewati batas
+async def evict_price_history(count):
+    for key, _ in await redis_client.zpopmin("price_history:access", count):
+        await remove_price_history(key)
+        logger.info(f"🗑️ Cache harga '{key}' dibuang (LRU)")
+
+def price_cache_state(updated_at, now=None):
+    if updated_at is None:
+        return "expired"
+    age = (now or time.time()) - updated_at
+    if age <= PRICE_CACHE_TTL:
+        return "fresh"
+    if age <= PRICE_CACHE_STALE_TTL:
+        return "stale"
+    return "expired"
+
+async def search_price_index(question, limit=5):
+    tokens = tokenize_price_key(question)
+    if not tokens:
+        return []
+    *full_tokens, last_token = tokens
+    # Token terakhir bisa jadi belum lengkap ("iphone 1"), jadi ikut dicocokkan sebagai prefix
+    expansions = await redis_client.zrangebylex(
+        "price_index:tokens", f"[{last_token}", f"[{last_token}\U0010ffff", start=0, num=PRICE_INDEX_PREFIX_EXPANSIONS
+    )
+    if not expansions:
+        return []
+    pipe = redis_client.pipeline()
+    for token in expansions:
+        pipe.zinter([f"price_index:{t}" for t in full_tokens + [token]], aggregate="MIN", withscores=True)
+    ranked = {}
+    for token, matches in zip(expansions, await pipe.execute()):
+        penalty = 0 if token == last_token else 0.5
+        for key, score in matches:
+            rank = score - len(tokens) + penalty
+            if key not in ranked or rank < ranked[key]:
+                ranked[key] = rank
+    return sorted(ranked, key=ranked.get)[:limit]
+
+async def _get_price_record(key):
+    data = await redis_binary_client.hget("price_history", key)
+    return PriceRecord.unpack(data) if data is not None else None
+
+async def find_price_in_history(question):
+    key = question
+    record = await _get_price_record(key)
+    if record is None:
+        matches = await search_price_index(question, limit=1)
+        if not matches:
+            return None
+        key = matches[0]
+        record = await _get_price_record(key)
+        if record is None:
+            return None
+        logger.info(f"🔄 Menggunakan harga dari history '{key}' untuk '{question}'")
+    else:
+        logger.info(f"🔄 Menggunakan harga dari history untuk '{question}'")
+    await redis_client.zadd("price_history:access", {key: time.time()})
+    return key, record
 
 def normalize_price_query(text):
     text = text.lower().strip()
@@ -46,11 +223,3 @@ def normalize_price_query(text):
     text = " ".join(sorted(set(words), key=words.index))
     text = re.sub(r"\b(ipun|ipin|ipon|ip)(?:\s+(\d+))?\b", r"iphone \2", text).strip()
     return text.strip()
-
-def check_redis_connection():
-    try:
-        redis_client.ping()
-        return True
-    except redis.RedisError as e:
-        logger.error(f"❌ Gagal terhubung ke Redis: {e}")
-        return False
\ No newline at end of file